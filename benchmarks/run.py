@@ -0,0 +1,106 @@
+"""
+Compiles every benchmark program at each optimization level, builds it with a local C
+compiler against the runtime and times it. Results can be saved as JSON and compared
+against an earlier run to catch runtime regressions in generated code.
+
+    python benchmarks/run.py [names...] [--repeat N] [--json results.json] [--compare baseline.json]
+"""
+from __future__ import annotations
+import argparse
+import json
+import shutil
+import subprocess
+import sys
+from os import getenv
+from pathlib import Path
+from statistics import median
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from compiler.api import compile_file, Options  # noqa: E402
+from compiler.lang.compiler import find_runtime  # noqa: E402
+
+benchmarks = Path(__file__).parent
+levels = (0, 1)
+
+argparser = argparse.ArgumentParser(description="Times compiled Sphynx programs")
+argparser.add_argument("names", nargs="*", help="Benchmarks to run, all of them by default")
+argparser.add_argument("-r", "--repeat", type=int, default=5, help="Times each program is run")
+argparser.add_argument("--cc", type=str, default=getenv("CC", "cc"), help="The C compiler")
+argparser.add_argument("--cflags", type=str, default="-O2", help="Flags for the C compiler")
+argparser.add_argument("--json", type=str, help="Writes the results to a JSON file")
+argparser.add_argument("--compare", type=str, help="Compares against the results of an earlier run")
+argparser.add_argument("--threshold", type=float, default=0.05, help="Slowdown reported as a regression")
+
+
+def build(file: Path, level: int, directory: Path, cc: str, cflags: str) -> Path:
+    """Compiles a program to C at an optimization level, then to an executable."""
+    result = compile_file(file, Options(optimize=level))
+    if not result.success:
+        raise RuntimeError(f"{file} failed to compile\n{result.diagnostics.render()}")
+    runtime = find_runtime(getenv("SPHYNX_RUNTIME", None))
+    source = directory / f"{file.stem}_O{level}.c"
+    source.write_text(result.out)
+    executable = directory / f"{file.stem}_O{level}"
+    command = [
+        cc, *cflags.split(), "-o", str(executable), str(source), *map(str, sorted(runtime.rglob("*.c"))),
+        *[f"-I{folder}" for folder in (runtime, runtime / "Types", runtime / "Context")], "-lm",
+    ]
+    built = subprocess.run(command, capture_output=True, text=True)
+    if built.returncode:
+        raise RuntimeError(f"{file} failed to build at -O{level}\n{built.stderr}")
+    return executable
+
+
+def time(executable: Path, repeat: int) -> list[float]:
+    times = []
+    for _ in range(repeat):
+        start = perf_counter()
+        subprocess.run([str(executable)], check=True, stdout=subprocess.DEVNULL)
+        times.append(perf_counter() - start)
+    return times
+
+
+def main(argv: list[str] | None=None) -> int:
+    args = argparser.parse_args(argv)
+    if shutil.which(args.cc) is None:
+        argparser.error(f"C compiler {args.cc} not found")
+    files = sorted(benchmarks.glob("*.spx"))
+    if args.names:
+        files = [file for file in files if file.stem in args.names]
+
+    results: dict[str, dict[str, dict[str, float]]] = {}
+    print(f"{'benchmark':<24} {'level':>5} {'best':>10} {'median':>10} {'speedup':>8}")
+    with TemporaryDirectory() as directory:
+        for file in files:
+            results[file.stem] = {}
+            for level in levels:
+                times = time(build(file, level, Path(directory), args.cc, args.cflags), args.repeat)
+                results[file.stem][f"O{level}"] = {"best": min(times), "median": median(times)}
+                speedup = results[file.stem]["O0"]["median"] / median(times)
+                print(f"{file.stem:<24} {f'-O{level}':>5} {min(times):>9.4f}s {median(times):>9.4f}s {speedup:>7.2f}x")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    if not args.compare:
+        return 0
+
+    with open(args.compare, "r") as f:
+        baseline = json.load(f)
+    regressions = 0
+    for name, runs in results.items():
+        for level, run in runs.items():
+            if level not in baseline.get(name, {}):
+                continue
+            change = run["median"] / baseline[name][level]["median"] - 1
+            if change > args.threshold:
+                regressions += 1
+                print(f"Regression: {name} at -{level} is {change:.1%} slower")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    exit(main())
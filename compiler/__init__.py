@@ -1,3 +1,5 @@
 __version__ = "0.0.1"
 __author__ = "Haven Selph"
 __license__ = "MIT License"
+
+from compiler.api import compile_source, compile_file, Options, Result  # noqa: E402
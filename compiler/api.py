@@ -0,0 +1,97 @@
+from __future__ import annotations
+from mmap import mmap, ACCESS_READ
+from pathlib import Path
+
+from compiler.lang.common.diagnostics import Diagnostics
+from compiler.lang.common.error import SphynxError
+from compiler.lang.common.factory import NodeFactory
+from compiler.lang.lexer import Lexer
+from compiler.lang.parser import Parser
+from compiler.lang.compiler import Compiler
+
+
+class Options:
+    def __init__(self, optimize: int=0, jobs: int=1, split: bool=False, max_errors: int | None=None,
+                 runtime: str | Path | None=None, line_directives: bool=False, source_map: bool=False,
+                 instrument: bool=False, hash_cons: bool=False) -> None:
+        self.optimize = optimize
+        self.jobs = jobs
+        self.split = split
+        self.line_directives = line_directives
+        self.source_map = source_map
+        self.instrument = instrument
+        self.hash_cons = hash_cons
+        self.max_errors = max_errors
+        self.runtime = Path(runtime) if runtime is not None else None
+
+
+class Result:
+    def __init__(self, filename: str, diagnostics: Diagnostics) -> None:
+        self.filename = filename
+        self.diagnostics = diagnostics
+        self.out = ""
+        self.units: list[str] = []
+        self.report: list[str] = []
+        self.source_map: str | None = None
+
+    @property
+    def success(self) -> bool:
+        return not self.diagnostics.errors
+
+    def __repr__(self) -> str:
+        return f"Result({self.filename}, success={self.success}, diagnostics={len(self.diagnostics.diagnostics)})"
+
+
+def compile_source(source: str | bytes, filename: str="<source>", options: Options | None=None) -> Result:
+    """
+    Compiles a program held in memory to C, without printing, exiting or writing files.
+    Every call uses its own lexer, parser and compiler, so calls are safe to make from
+    several threads at once; the runtime location and headers are looked up only once.
+    """
+    options = options or Options()
+    diagnostics = Diagnostics(options.max_errors)
+    result = Result(filename, diagnostics)
+    try:
+        return _compile(source, filename, options, result)
+    finally:
+        if diagnostics.diagnostics:
+            # Diagnostics render from the source given here, not whatever is on disk under its name.
+            # Bytes are only decoded when there is something to show, and before a mapping is closed.
+            diagnostics.add_source(filename, source)
+
+
+def _compile(source: str | bytes, filename: str, options: Options, result: Result) -> Result:
+    diagnostics = result.diagnostics
+    try:
+        factory = NodeFactory() if options.hash_cons else None
+        parser = Parser(filename, Lexer(filename, source).stream(), factory)
+        program = parser.parse()
+        if parser.errors:
+            diagnostics.extend(parser.errors)
+            return result
+        comp = Compiler(filename, program, options.optimize, options.jobs, options.split, options.runtime,
+                        options.line_directives, options.source_map, options.instrument, factory)
+        if factory:
+            comp.optimizer.note(f"hash-cons: shared {factory.shared} of {factory.created} expression nodes")
+        comp.compile()
+        diagnostics.extend(comp.warnings).extend(comp.errors)
+    except SphynxError as e:
+        diagnostics.add(e)
+        return result
+    if not comp.errors:
+        result.out = comp.out
+        result.units = comp.units
+        result.source_map = comp.source_map
+    result.report = comp.optimizer.report
+    return result
+
+
+def compile_file(file: str | Path, options: Options | None=None) -> Result:
+    """Compiles a file to C, memory mapping it rather than reading it. See compile_source."""
+    with open(file, "rb") as f:
+        source = mmap(f.fileno(), 0, access=ACCESS_READ) if Path(file).stat().st_size else b""
+    try:
+        return compile_source(source, str(file), options)
+    finally:
+        if isinstance(source, mmap):
+            source.close()
@@ -0,0 +1,201 @@
+from __future__ import annotations
+from typing import Callable, Hashable
+
+import compiler.lang.common.ast as ast
+
+
+# Operations that compile to side effect free runtime calls; evaluating
+# them twice on the same inputs always yields an equal Value.
+pure_operations = (
+    ast.Add, ast.Subtract, ast.Multiply, ast.Divide, ast.Modulo, ast.Power,
+    ast.EqualEqual, ast.NotEqual, ast.LessThan, ast.LessThanOrEqual,
+    ast.GreaterThan, ast.GreaterThanOrEqual, ast.Cast, ast.Negate, ast.Not,
+)
+
+# Statements which introduce their own block, and so end the current basic block.
+compound_statements = (ast.Block, ast.If, ast.While, ast.Function)
+
+
+def children(node: ast.Node) -> list[ast.Node]:
+    """Returns the direct child nodes of a node, in evaluation order."""
+    match node:
+        case ast.Block():
+            return list(node.statements)
+        case ast.If():
+            return [node.condition, node.body] + ([node.else_body] if node.else_body else [])
+        case ast.While():
+            return [node.condition, node.body]
+        case ast.Function():
+            return [node.body]
+        case ast.ConstantDeclaration() | ast.VariableDeclaration() | ast.VariableAssignment():
+            return [node.value]
+        case ast.UnaryOp():
+            return [node.value]
+        case ast.BinaryOp():
+            return [node.left, node.right]
+        case ast.Call():
+            return [node.name] + list(node.args)
+    return []
+
+
+def map_children(node: ast.Node, fn: Callable[[ast.Node], ast.Node]) -> ast.Node:
+    """Replaces every direct child of a node with fn(child), in place."""
+    match node:
+        case ast.Block():
+            node.statements = [fn(statement) for statement in node.statements]
+        case ast.If():
+            node.condition = fn(node.condition)
+            node.body = fn(node.body)
+            if node.else_body:
+                node.else_body = fn(node.else_body)
+        case ast.While():
+            node.condition = fn(node.condition)
+            node.body = fn(node.body)
+        case ast.Function():
+            node.body = fn(node.body)
+        case ast.ConstantDeclaration() | ast.VariableDeclaration() | ast.VariableAssignment():
+            node.value = fn(node.value)
+        case ast.UnaryOp():
+            node.value = fn(node.value)
+        case ast.BinaryOp():
+            node.left = fn(node.left)
+            node.right = fn(node.right)
+        case ast.Call():
+            node.name = fn(node.name)
+            node.args = [fn(arg) for arg in node.args]
+    return node
+
+
+def walk(node: ast.Node):
+    """Yields a node and all of its descendants, parents first."""
+    yield node
+    for child in children(node):
+        yield from walk(child)
+
+
+def key(node: ast.Node) -> Hashable:
+    """Returns a hashable key which is equal for structurally identical nodes."""
+    match node:
+        case ast.Literal():
+            return type(node).__name__, type(node.value).__name__, node.value
+        case ast.VariableReference():
+            return "VariableReference", node.name
+        case ast.VariableDeclaration() | ast.VariableAssignment() | ast.ConstantDeclaration():
+            return type(node).__name__, node.name, key(node.value)
+        case ast.Function():
+            return "Function", node.name, tuple(node.args), key(node.body)
+    return (type(node).__name__,) + tuple(key(child) for child in children(node))
+
+
+def is_pure(node: ast.Node) -> bool:
+    """Whether a node can be evaluated any number of times without observable effects."""
+    match node:
+        case ast.Literal() | ast.VariableReference():
+            return True
+        case _ if isinstance(node, pure_operations):
+            return all(is_pure(child) for child in children(node))
+    return False
+
+
+def references(node: ast.Node) -> set[str]:
+    """Returns the names of all variables read by a node."""
+    return {child.name for child in walk(node) if isinstance(child, ast.VariableReference)}
+
+
+def assignments(node: ast.Node) -> set[str]:
+    """Returns the names of all variables written or declared by a node."""
+    return {
+        child.name for child in walk(node)
+        if isinstance(child, (ast.VariableAssignment, ast.VariableDeclaration, ast.ConstantDeclaration))
+    }
+
+
+# Static types, from most to least precise. "uint" is an integer known to be non-negative.
+never, uint, integer, floating, string = "never", "uint", "int", "float", "str"
+numeric = (uint, integer, floating)
+
+
+def join(a: str | None, b: str | None) -> str | None:
+    """Returns the most precise type describing both a and b, None if there is none."""
+    if a == never or a == b:
+        return b
+    if b == never:
+        return a
+    if {a, b} == {uint, integer}:
+        return integer
+    return None
+
+
+def type_of(node: ast.Node, types: dict[str, str | None]) -> str | None:
+    """Returns the static type of an expression, or None if it is not known."""
+    match node:
+        case ast.Integer():
+            return uint if node.value >= 0 else integer
+        case ast.Float():
+            return floating
+        case ast.String():
+            return string
+        case ast.VariableReference():
+            return types.get(node.name)
+        case ast.Negate():
+            value = type_of(node.value, types)
+            return integer if value == uint else value if value in (never, integer, floating) else None
+        case ast.Add() | ast.Subtract() | ast.Multiply() | ast.Modulo() | ast.Power():
+            left, right = type_of(node.left, types), type_of(node.right, types)
+            if never in (left, right):
+                return never
+            if left == right == uint and not isinstance(node, ast.Subtract):
+                return uint
+            if isinstance(node, ast.Power) or left not in numeric or right not in numeric:
+                return string if isinstance(node, ast.Add) and left == right == string else None
+            if (left == floating) != (right == floating):
+                return None
+            return floating if left == floating else integer
+    return None
+
+
+def cannot_fail(node: ast.Node, types: dict[str, str | None]) -> bool:
+    """
+    Whether evaluating an expression can never raise a runtime error, as every operation
+    in it has operands of statically known, compatible types.
+    """
+    for child in walk(node):
+        match child:
+            case ast.Literal() | ast.VariableReference():
+                continue
+            case ast.EqualEqual() | ast.NotEqual() | ast.LessThan() | ast.LessThanOrEqual() \
+                    | ast.GreaterThan() | ast.GreaterThanOrEqual():
+                left, right = type_of(child.left, types), type_of(child.right, types)
+                if left is None or left == never or join(left, right) is None:
+                    return False
+            case ast.Divide() | ast.Modulo() if not isinstance(child.right, ast.Literal) or not child.right.value:
+                # Only a constant divisor is known not to be zero
+                return False
+            case _ if type_of(child, types) in (None, never):
+                return False
+    return True
+
+
+def infer_types(program: ast.Node) -> dict[str, str | None]:
+    """
+    Infers the type of every variable from all of its stores, optimistically, so that
+    loop counters such as `i = i + 1` keep the type of their declaration.
+    """
+    stores = [
+        (node.name, node.value) for node in walk(program)
+        if isinstance(node, (ast.VariableAssignment, ast.VariableDeclaration, ast.ConstantDeclaration))
+    ]
+    types = {name: never for name, _ in stores}
+    for node in walk(program):
+        if isinstance(node, ast.Function):
+            # Arguments can hold anything
+            types.update({name: None for name in node.args})
+    changed = True
+    while changed:
+        changed = False
+        for name, value in stores:
+            joined = join(types[name], type_of(value, types))
+            if joined != types[name]:
+                types[name] = joined
+                changed = True
+    return types
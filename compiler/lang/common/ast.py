@@ -50,6 +50,7 @@ class Function(Node):
         self.name = name
         self.args = args
         self.body = body
+        self.bindings: list[tuple[int, int]] = []
 
     def __repr__(self) -> str:
         return f"Function({self.name}, {self.args}, {self.body})"
@@ -60,6 +61,7 @@ class ConstantDeclaration(Node):
         super().__init__(span)
         self.name = name
         self.value = value
+        self.binding: tuple[int, int] | None = None
 
     def __repr__(self) -> str:
         return f"ConstantDeclaration({self.name}, {self.value})"
@@ -70,6 +72,7 @@ class VariableDeclaration(Node):
         super().__init__(span)
         self.name = name
         self.value = value
+        self.binding: tuple[int, int] | None = None
 
     def __repr__(self) -> str:
         return f"VariableDeclaration({self.name}, {self.value})"
@@ -79,6 +82,7 @@ class VariableReference(Node):
     def __init__(self, span: Span, name: str) -> None:
         super().__init__(span)
         self.name = name
+        self.binding: tuple[int, int] | None = None
 
     def __repr__(self) -> str:
         return f"VariableReference({self.name})"
@@ -89,11 +93,21 @@ class VariableAssignment(Node):
         super().__init__(span)
         self.name = name
         self.value = value
+        self.binding: tuple[int, int] | None = None
 
     def __repr__(self) -> str:
         return f"VariableAssignment({self.name}, {self.value})"
 
 
+class Invalid(Node):
+    """Stands in for a declaration value which failed to parse."""
+    def __init__(self, span: Span) -> None:
+        super().__init__(span)
+
+    def __repr__(self) -> str:
+        return "Invalid()"
+
+
 class Literal(Node, ABC):
     def __init__(self, span: Span, value: str) -> None:
         super().__init__(span)
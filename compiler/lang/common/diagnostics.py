@@ -0,0 +1,91 @@
+from __future__ import annotations
+from json import dumps
+from mmap import mmap
+from typing import Iterable
+
+from compiler.lang.common.error import SphynxError, SpanError
+
+
+class Diagnostics:
+    """
+    Collects errors and warnings to render them all at once. Each source file is read
+    a single time no matter how many diagnostics point into it; diagnostics are sorted
+    by location, duplicates are dropped, and at most max_errors errors are shown. Warnings
+    don't count against the limit and are always shown.
+    """
+    def __init__(self, max_errors: int | None=None) -> None:
+        if max_errors is not None and max_errors < 1:
+            raise ValueError(f"max_errors must be at least 1, got {max_errors}")
+        self.max_errors = max_errors
+        self.diagnostics: list[SphynxError] = []
+        self.sources: dict[str, list[str]] = {}
+
+    def add(self, diagnostic: SphynxError) -> Diagnostics:
+        self.diagnostics.append(diagnostic)
+        return self
+
+    def extend(self, diagnostics: Iterable[SphynxError]) -> Diagnostics:
+        self.diagnostics.extend(diagnostics)
+        return self
+
+    @property
+    def errors(self) -> int:
+        return sum(1 for diagnostic in self.sorted() if diagnostic.severity == "error")
+
+    def add_source(self, filename: str, text: str | bytes | mmap) -> None:
+        """Provides the text of a file, for sources which only exist in memory. Bytes are decoded as UTF-8."""
+        if not isinstance(text, str):
+            text = str(text, "utf-8", "replace")
+        self.sources[filename] = [line.rstrip() for line in text.splitlines()]
+
+    def source(self, filename: str) -> list[str]:
+        if filename not in self.sources:
+            with open(filename, "r") as f:
+                self.sources[filename] = [line.rstrip() for line in f.readlines()]
+        return self.sources[filename]
+
+    def sorted(self) -> list[SphynxError]:
+        """Returns the unique diagnostics, in source order."""
+        unique = {}
+        for diagnostic in self.diagnostics:
+            unique.setdefault(tuple(diagnostic.to_json().values()), diagnostic)
+
+        def location(diagnostic: SphynxError) -> tuple:
+            if not isinstance(diagnostic, SpanError):
+                return "", 0, 0
+            return diagnostic.span.filename, diagnostic.span.start.line, diagnostic.span.start.column
+        return sorted(unique.values(), key=location)
+
+    def shown(self) -> tuple[list[SphynxError], int]:
+        """Returns the diagnostics to show, and how many errors were left out."""
+        diagnostics = self.sorted()
+        if self.max_errors is None:
+            return diagnostics, 0
+        shown, errors = [], 0
+        for diagnostic in diagnostics:
+            if diagnostic.severity == "error":
+                errors += 1
+                if errors > self.max_errors:
+                    continue
+            shown.append(diagnostic)
+        return shown, len(diagnostics) - len(shown)
+
+    def to_json(self) -> str:
+        """Renders the diagnostics in a machine readable form."""
+        shown, hidden = self.shown()
+        return dumps({"diagnostics": [diagnostic.to_json() for diagnostic in shown], "hidden": hidden})
+
+    def render(self) -> str:
+        shown, hidden = self.shown()
+        out = [
+            diagnostic.render(self.source(diagnostic.span.filename)) if isinstance(diagnostic, SpanError)
+            else diagnostic.render()
+            for diagnostic in shown
+        ]
+        if hidden:
+            out.append(f"... and {hidden} more error{'s' if hidden > 1 else ''}")
+        return "\n".join(out)
+
+    def print(self) -> None:
+        if self.diagnostics:
+            print(self.render())
@@ -2,25 +2,35 @@ from compiler.lang.common.location import Span
 
 
 class SphynxError(Exception):
+    severity = "error"
+
     def print_error(self) -> None:
         """Prints the error to the terminal."""
         raise NotImplementedError()
 
+    def to_json(self) -> dict:
+        """Returns the error as a JSON serializable dictionary."""
+        raise NotImplementedError()
+
 
 class SpanError(SphynxError):
-    def __init__(self, span: Span, message: str, flag_text: str="", color: str="\u001b[31m") -> None:
+    def __init__(self, span: Span, message: str, flag_text: str="", color: str="\u001b[31m", severity: str="error") -> None:
         self.span = span
         self.message = message
         self.flag_text = flag_text
         self.color = color
+        self.severity = severity
 
     def print_error(self) -> None:
         """Prints the error to the terminal."""
-        # todo: spans are fucked, fix it
-        print(self.span)
-        print(f"{self.color}{self.message}\u001b[0m")
         with open(self.span.filename, "r") as f:
             lines = [line.rstrip() for line in f.readlines()]
+        print(self.render(lines))
+
+    def render(self, lines: list[str]) -> str:
+        """Renders the error against the already read lines of its file."""
+        # todo: spans are fucked, fix it
+        out = [str(self.span), f"{self.color}{self.message}\u001b[0m"]
         context = 2
         start = self.span.start
         end = self.span.end
@@ -32,13 +42,26 @@ class SpanError(SphynxError):
             if start.line - 1 <= line_n < end.line:
                 highlight_start = start.column - 1 if line_n == start.line - 1 else 0
                 highlight_end = end.column - 1 if line_n == end.line - 1 else len(line)
-                print(f"{line_n:0>3} | {line[:highlight_start]}{self.color}{line[highlight_start:highlight_end]}\u001b[0m{line[highlight_end:]}")
+                out.append(f"{line_n:0>3} | {line[:highlight_start]}{self.color}{line[highlight_start:highlight_end]}\u001b[0m{line[highlight_end:]}")
                 if start.line == end.line:
-                    print("    | " + "-" * highlight_start + self.color + "^" * (highlight_end - highlight_start) + "\u001b[0m")
+                    out.append("    | " + "-" * highlight_start + self.color + "^" * (highlight_end - highlight_start) + "\u001b[0m")
                     if self.flag_text:
-                        print("    | " + " " * highlight_start + self.color + self.flag_text + "\u001b[0m")
+                        out.append("    | " + " " * highlight_start + self.color + self.flag_text + "\u001b[0m")
             else:
-                print(f"{line_n:0>3} | {line}")
+                out.append(f"{line_n:0>3} | {line}")
+        return "\n".join(out)
+
+    def to_json(self) -> dict:
+        return {
+            "severity": self.severity,
+            "message": self.message,
+            "flag": self.flag_text or None,
+            "file": self.span.filename,
+            "line": self.span.start.line,
+            "column": self.span.start.column,
+            "end_line": self.span.end.line,
+            "end_column": self.span.end.column,
+        }
 
 
 class GenericError(SphynxError):
@@ -47,4 +70,11 @@ class GenericError(SphynxError):
         self.color = color
 
     def print_error(self) -> None:
-        print(f"{self.color}{self.message}\u001b[0m")
+        print(self.render())
+
+    def render(self) -> str:
+        return f"{self.color}{self.message}\u001b[0m"
+
+    def to_json(self) -> dict:
+        return {"severity": self.severity, "message": self.message, "flag": None, "file": None,
+                "line": None, "column": None, "end_line": None, "end_column": None}
@@ -0,0 +1,80 @@
+from __future__ import annotations
+from copy import copy
+from typing import Hashable
+
+from compiler.lang.common.analysis import map_children
+from compiler.lang.common.location import Span
+import compiler.lang.common.ast as ast
+
+
+class NodeFactory:
+    """
+    Hash-conses expression trees: structurally identical subtrees made only of literals,
+    operations and calls are replaced by a single shared node. Sharing happens while
+    parsing, before names are bound, so a subtree reading any variable is never shared:
+    in practice, constant expressions and calls with constant arguments. A shared node
+    keeps the span of its first occurrence, the spans of all of them are listed in
+    self.spans, see occurrences.
+    """
+    def __init__(self) -> None:
+        self.nodes: dict[Hashable, ast.Node] = {}
+        self.spans: dict[int, list[Span]] = {}
+        self.created = 0
+
+    @property
+    def shared(self) -> int:
+        """How many nodes were replaced by one built before."""
+        return self.created - len(self.nodes)
+
+    def occurrences(self, node: ast.Node) -> list[Span]:
+        """Returns the span of every place a node appears in the source."""
+        return self.spans.get(id(node), [node.span])
+
+    def intern(self, node: ast.Node, statement: bool=True) -> ast.Node:
+        """
+        Shares the subtrees of a freshly parsed node, returning the node to use in its place.
+        Statements themselves are never shared, as each of them has its own location.
+        """
+        map_children(node, lambda child: self.intern(child, isinstance(node, ast.Block)))
+        key = None if statement else self.key(node)
+        if key is None:
+            return node
+        self.created += 1
+        shared = self.nodes.setdefault(key, node)
+        self.spans.setdefault(id(shared), []).append(node.span)
+        return shared
+
+    def expand(self, node: ast.Node) -> ast.Node:
+        """
+        Returns a copy of a tree in which every occurrence of a shared node is a node of its
+        own again, with its own span, so it can be rewritten in place or written out. The
+        tree itself is left shared. Spans were recorded in tree order, so the n-th occurrence
+        met here is the n-th one parsed.
+        """
+        seen: dict[int, int] = {}
+
+        def visit(child: ast.Node) -> ast.Node:
+            copied = copy(child)
+            if self.is_shared(child):
+                occurrence = seen.get(id(child), 0)
+                seen[id(child)] = occurrence + 1
+                copied.span = self.spans[id(child)][occurrence]
+            return map_children(copied, visit)
+        return visit(node)
+
+    def key(self, node: ast.Node) -> Hashable | None:
+        # Children are already interned, so they compare by identity; shared nodes are kept
+        # alive by self.nodes, so their ids are never reused.
+        match node:
+            case ast.Literal():
+                return type(node).__name__, type(node.value).__name__, node.value
+            case ast.UnaryOp() if self.is_shared(node.value):
+                return type(node).__name__, id(node.value)
+            case ast.BinaryOp() if self.is_shared(node.left) and self.is_shared(node.right):
+                return type(node).__name__, id(node.left), id(node.right)
+            case ast.Call() if isinstance(node.name, ast.VariableReference) and all(map(self.is_shared, node.args)):
+                return "Call", node.name.name, tuple(id(arg) for arg in node.args)
+        return None
+
+    def is_shared(self, node: ast.Node) -> bool:
+        return id(node) in self.spans
@@ -0,0 +1,361 @@
+from __future__ import annotations
+from mmap import mmap, ACCESS_READ
+from pathlib import Path
+from struct import Struct, error as StructError
+from typing import BinaryIO
+
+from compiler.lang.common.location import Location, Span
+from compiler.lang.common.token import Token, TokenKind
+from compiler.lang.common.error import GenericError
+import compiler.lang.common.ast as ast
+
+
+# File layout, all integers are LEB128 varints:
+#   magic, version, content (tokens/ast), filename (string index)
+#   string count, then per string its byte length followed by its UTF-8 bytes
+#   payload
+# Identifiers and other strings are interned in the string table. Locations are interned
+# too: one used before is written as how many locations were used since, and a new one
+# relative to the previous, which on the same line of ASCII text is a single small delta.
+# A node is written as its type id, start, contents, then end, so that ends it shares
+# with its last child are recent; operations spanning exactly their operands skip both.
+magic = b"SPXB"
+version = 2
+content_tokens, content_ast = 0, 1
+
+# Node type ids, append only: reordering breaks existing files
+node_types = [
+    ast.Block, ast.If, ast.While, ast.Function, ast.ConstantDeclaration, ast.VariableDeclaration,
+    ast.VariableReference, ast.VariableAssignment, ast.Integer, ast.Float, ast.String, ast.Negate,
+    ast.Not, ast.Call, ast.Add, ast.Subtract, ast.Power, ast.Multiply, ast.Divide, ast.Modulo,
+    ast.LogicalAnd, ast.LogicalOr, ast.EqualEqual, ast.NotEqual, ast.LessThan, ast.LessThanOrEqual,
+    ast.GreaterThan, ast.GreaterThanOrEqual, ast.Cast,
+]
+node_ids = {kind: index for index, kind in enumerate(node_types)}
+
+data_none, data_int, data_float, data_string = range(4)
+double = Struct("<d")
+
+
+def zigzag(value: int) -> int:
+    """Maps signed integers to unsigned ones, small magnitudes to small values."""
+    return value << 1 if value >= 0 else (-value << 1) - 1
+
+
+def unzigzag(value: int) -> int:
+    return value >> 1 if not value & 1 else -((value + 1) >> 1)
+
+
+def position(location: Location) -> tuple[int, int, int]:
+    return location.line, location.column, location.index
+
+
+class Writer:
+    def __init__(self, filename: str) -> None:
+        self.out = bytearray()
+        self.strings = {}
+        self.previous = Location(filename, 1, 1, 0)
+        # Every location written, by (line, column, index), to when it was last used
+        self.locations: dict[tuple[int, int, int], int] = {}
+        self.uses = 0
+        self.filename = self.string(filename)
+
+    def varint(self, value: int) -> None:
+        while value > 0x7f:
+            self.out.append(value & 0x7f | 0x80)
+            value >>= 7
+        self.out.append(value)
+
+    def signed(self, value: int) -> None:
+        self.varint(zigzag(value))
+
+    def string(self, value: str) -> int:
+        return self.strings.setdefault(value, len(self.strings))
+
+    def text(self, value: str) -> None:
+        self.varint(self.string(value))
+
+    def data(self, value: int | float | str | None) -> None:
+        match value:
+            case None:
+                self.varint(data_none)
+            case bool() | int():
+                self.varint(data_int)
+                self.signed(value)
+            case float():
+                self.varint(data_float)
+                self.out += double.pack(value)
+            case str():
+                self.varint(data_string)
+                self.text(value)
+
+    def location(self, location: Location) -> None:
+        # The lowest bit tells a reference to an earlier location from a new one
+        used, current = self.locations.get(position(location)), self.uses
+        self.locations[position(location)] = current
+        self.uses += 1
+        if used is not None:
+            self.varint((current - used - 1) << 1 | 1)
+            return
+        # Index moves by as many bytes as the column, unless the line or its characters change
+        offset = (location.index - location.column) - (self.previous.index - self.previous.column)
+        line = location.line - self.previous.line
+        if line == 0 and offset == 0:
+            self.varint(zigzag(location.column - self.previous.column) << 2 | 2)
+        else:
+            self.varint(zigzag(line) << 2)
+            self.varint(location.column)
+            self.signed(offset)
+        self.previous = location
+
+    def span(self, span: Span) -> None:
+        self.location(span.start)
+        self.location(span.end)
+
+    def token(self, token: Token) -> None:
+        self.varint(token.kind.value << 1 | token.new_line_before)
+        self.data(token.data)
+        self.span(token.span)
+
+    def node(self, node: ast.Node) -> None:
+        if type(node) not in node_ids:
+            raise GenericError(f"Cannot serialize node type {type(node)}")
+        if isinstance(node, ast.BinaryOp) and position(node.span.start) == position(node.left.span.start) \
+                and position(node.span.end) == position(node.right.span.end):
+            self.varint(node_ids[type(node)] << 1 | 1)
+            self.node(node.left)
+            self.node(node.right)
+            return
+        self.varint(node_ids[type(node)] << 1)
+        self.location(node.span.start)
+        match node:
+            case ast.Block():
+                self.varint(len(node.statements))
+                for statement in node.statements:
+                    self.node(statement)
+            case ast.If():
+                self.node(node.condition)
+                self.node(node.body)
+                self.varint(node.else_body is not None)
+                if node.else_body is not None:
+                    self.node(node.else_body)
+            case ast.While():
+                self.node(node.condition)
+                self.node(node.body)
+            case ast.Function():
+                self.text(node.name)
+                self.varint(len(node.args))
+                for arg in node.args:
+                    self.text(arg)
+                self.node(node.body)
+            case ast.ConstantDeclaration() | ast.VariableDeclaration() | ast.VariableAssignment():
+                self.text(node.name)
+                self.node(node.value)
+            case ast.VariableReference():
+                self.text(node.name)
+            case ast.Literal():
+                self.data(node.value)
+            case ast.UnaryOp():
+                self.node(node.value)
+            case ast.BinaryOp():
+                self.node(node.left)
+                self.node(node.right)
+            case ast.Call():
+                self.node(node.name)
+                self.varint(len(node.args))
+                for arg in node.args:
+                    self.node(arg)
+        self.location(node.span.end)
+
+    def finish(self, content: int) -> bytes:
+        header = Writer.__new__(Writer)
+        header.out = bytearray(magic)
+        header.varint(version)
+        header.varint(content)
+        header.varint(self.filename)
+        header.varint(len(self.strings))
+        for value in self.strings:
+            encoded = value.encode("utf-8")
+            header.varint(len(encoded))
+            header.out += encoded
+        return bytes(header.out + self.out)
+
+
+class Reader:
+    """Decodes directly from any buffer, so a memory mapped file is never read into memory as a whole."""
+    def __init__(self, buffer) -> None:
+        self.buffer = memoryview(buffer)
+        self.index = 0
+
+    def header(self) -> None:
+        """Checks the magic and version, and locates the strings."""
+        if bytes(self.buffer[:len(magic)]) != magic:
+            raise GenericError("Not a Sphynx binary file")
+        self.index = len(magic)
+        # Locations in the order they were used, see Writer.location
+        self.locations: list[Location] = []
+        if (file_version := self.varint()) != version:
+            raise GenericError(f"Unsupported Sphynx binary version {file_version}, expected {version}")
+        self.content = self.varint()
+        filename = self.varint()
+
+        # Strings are only decoded once they are first used
+        self.offsets = []
+        for _ in range(self.varint()):
+            length = self.varint()
+            self.offsets.append((self.index, self.index + length))
+            self.index += length
+        if self.index > len(self.buffer):
+            # Slicing would silently cut the last string short
+            raise GenericError("Corrupt Sphynx binary file")
+        self.strings = {}
+        self.filename = self.string(filename)
+        self.previous = Location(self.filename, 1, 1, 0)
+
+    def varint(self) -> int:
+        value = shift = 0
+        while True:
+            byte = self.buffer[self.index]
+            self.index += 1
+            value |= (byte & 0x7f) << shift
+            if byte < 0x80:
+                return value
+            shift += 7
+
+    def signed(self) -> int:
+        return unzigzag(self.varint())
+
+    def string(self, index: int) -> str:
+        if index not in self.strings:
+            start, end = self.offsets[index]
+            self.strings[index] = str(self.buffer[start:end], "utf-8")
+        return self.strings[index]
+
+    def text(self) -> str:
+        return self.string(self.varint())
+
+    def data(self) -> int | float | str | None:
+        kind = self.varint()
+        if kind == data_none:
+            return None
+        if kind == data_int:
+            return self.signed()
+        if kind == data_float:
+            value = double.unpack_from(self.buffer, self.index)[0]
+            self.index += double.size
+            return value
+        if kind == data_string:
+            return self.text()
+        raise GenericError("Corrupt Sphynx binary file")
+
+    def location(self) -> Location:
+        header = self.varint()
+        if header & 1:
+            if header >> 1 >= len(self.locations):
+                raise GenericError("Corrupt Sphynx binary file")
+            location = self.locations[len(self.locations) - 1 - (header >> 1)]
+            self.locations.append(location)
+            return location
+        previous = self.previous
+        if header & 2:
+            column = previous.column + unzigzag(header >> 2)
+            line, index = previous.line, previous.index + column - previous.column
+        else:
+            line, column = previous.line + unzigzag(header >> 2), self.varint()
+            index = previous.index + column - previous.column + self.signed()
+        self.previous = Location(self.filename, line, column, index)
+        self.locations.append(self.previous)
+        return self.previous
+
+    def span(self) -> Span:
+        return Span(self.location(), self.location())
+
+    def token(self) -> Token:
+        header = self.varint()
+        data = self.data()
+        return Token(TokenKind(header >> 1), data, self.span(), bool(header & 1))
+
+    def node(self) -> ast.Node:
+        header = self.varint()
+        kind = node_types[header >> 1]
+        if header & 1:
+            # An operation spanning exactly its operands, see Writer.node
+            if not issubclass(kind, ast.BinaryOp):
+                raise GenericError("Corrupt Sphynx binary file")
+            return kind(self.node(), self.node())
+        start = self.location()
+        if kind is ast.Block:
+            node = ast.Block(None, [self.node() for _ in range(self.varint())])
+        elif kind is ast.If:
+            condition, body = self.node(), self.node()
+            node = ast.If(None, condition, body, self.node() if self.varint() else None)
+        elif kind is ast.While:
+            node = ast.While(None, self.node(), self.node())
+        elif kind is ast.Function:
+            name = self.text()
+            args = [self.text() for _ in range(self.varint())]
+            node = ast.Function(None, name, args, self.node())
+        elif kind in (ast.ConstantDeclaration, ast.VariableDeclaration, ast.VariableAssignment):
+            node = kind(None, self.text(), self.node())
+        elif kind is ast.VariableReference:
+            node = ast.VariableReference(None, self.text())
+        elif issubclass(kind, ast.Literal):
+            node = kind(None, self.data())
+        elif issubclass(kind, ast.UnaryOp):
+            node = kind(None, self.node())
+        elif issubclass(kind, ast.BinaryOp):
+            node = kind(self.node(), self.node())
+        else:
+            name = self.node()
+            node = ast.Call(None, name, [self.node() for _ in range(self.varint())])
+        node.span = Span(start, self.location())
+        return node
+
+    def read(self) -> list[Token] | ast.Node:
+        if self.content == content_tokens:
+            return [self.token() for _ in range(self.varint())]
+        return self.node()
+
+
+def dumps(value: list[Token] | ast.Node) -> bytes:
+    """Serializes a token stream or an AST into the compact binary format."""
+    if isinstance(value, ast.Node):
+        writer = Writer(value.span.filename)
+        writer.node(value)
+        return writer.finish(content_ast)
+    writer = Writer(value[0].span.filename if value else "")
+    writer.varint(len(value))
+    for token in value:
+        writer.token(token)
+    return writer.finish(content_tokens)
+
+
+def dump(value: list[Token] | ast.Node, file: BinaryIO) -> None:
+    file.write(dumps(value))
+
+
+def read(buffer: bytes | bytearray | memoryview | mmap) -> list[Token] | ast.Node:
+    reader = Reader(buffer)
+    try:
+        reader.header()
+        return reader.read()
+    except (IndexError, ValueError, StructError, RecursionError) as e:
+        # Reads run past the end of a truncated file, or decode garbage from a corrupt one
+        raise GenericError("Corrupt Sphynx binary file") from e
+    finally:
+        # A mapped file cannot be closed while the view is still open
+        reader.buffer.release()
+
+
+def loads(buffer: bytes | bytearray | memoryview | mmap) -> list[Token] | ast.Node:
+    """Deserializes a token stream or an AST, reading straight from the buffer."""
+    return read(buffer)
+
+
+def load(path: str | Path) -> list[Token] | ast.Node:
+    """Deserializes a token stream or an AST from a file, memory mapping it instead of reading it."""
+    with open(path, "rb") as file:
+        if not Path(path).stat().st_size:
+            raise GenericError("Not a Sphynx binary file")
+        with mmap(file.fileno(), 0, access=ACCESS_READ) as buffer:
+            return read(buffer)
@@ -56,6 +56,9 @@ class TokenKind(Enum):
     Integer = auto()
     Float = auto()
 
+    # Bad input, the SpanError describing it is the data. Last, so the other values never change
+    Error = auto()
+
 
 characters = {
     # Symbols
@@ -2,130 +2,513 @@ from __future__ import annotations
 from compiler.lang.common.location import Location, Span
 from compiler.lang.common.token import Token, TokenKind
 from compiler.lang.common.error import SphynxError, SpanError, GenericError
+from compiler.lang.common.diagnostics import Diagnostics
+from compiler.lang.common.factory import NodeFactory
+from compiler.lang.optimizer import Optimizer
+from compiler.lang.resolver import Resolver
+from compiler.lang.sourcemap import SourceMapper, mark, unmark
+import compiler.lang.instrument as instrumentation
 from pathlib import Path
 from os import getenv
+from typing import Iterable, TextIO
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from tempfile import TemporaryFile
+from functools import lru_cache
 import compiler.lang.common.ast as ast
 
 
+# Nodes which compile to C statements rather than to a Value expression
+statements = (ast.Block, ast.If, ast.While, ast.VariableDeclaration, ast.ConstantDeclaration, ast.VariableAssignment)
+
+# Integer literals in this range, and the floats 0.0 and 1.0, use Values created once at
+# startup. The tables hold a reference to each of them forever, so they are never freed.
+small_ints = 256
+small_floats = (0.0, 1.0)
+
+# Runtime operations borrow their operands and return a new reference, while functions own
+# their arguments. Operands which aren't variables or immortal Values are kept in the
+# spxt_temps array of the enclosing C function, and released as soon as the statement
+# using them is done.
+
+
 class Compiler:
-    def __init__(self, filename: str, program: ast.Block) -> None:
+    def __init__(self, filename: str, program: ast.Block | None, optimize: int=0, jobs: int=1, split: bool=False,
+                 runtime: Path | None=None, line_directives: bool=False, source_map: bool=False,
+                 instrument: bool=False, factory: NodeFactory | None=None, output: str | None=None) -> None:
         self.filename = filename
+        # The C file the code is written to, which #line directives refer to for generated code
+        self.output = output or str(Path(filename).with_suffix(".c"))
         self.program = program
-        self.runtime = None
+        self.factory = factory
+        self.optimizer = Optimizer(self, optimize)
+        self.resolver = Resolver(self)
+        self.jobs = jobs
+        self.split = split
+        self.line_directives = line_directives
+        self.mapping = source_map
+        self.marking = line_directives or source_map
+        self.source_map = None
+        self.instrument = instrument
+        # Probes by C name, with the source location and kind of event they count
+        self.probes: dict[str, tuple[str, str]] = {}
+        # The probe that allocations, refs and unrefs are currently attributed to
+        self.site = None
+        # Temporaries live in the statement being compiled, and the most any statement of the function needs
+        self.temps = 0
+        self.frame_temps = 0
+        self.frame_tests = False
+        # Code generated for each expression node, see compile_node. Optimizing undoes the sharing.
+        self.memo: dict[tuple, tuple[ast.Node, str, int]] | None = None
+        if factory and not self.optimizer.enabled:
+            self.memo = {}
+        self.runtime = runtime
         self.check_runtime()
         self.out = ""
+        self.units = []
         self.errors = []
         self.warnings = []
         self.scopes = []
 
     def check_runtime(self):
-        env = True
-        runtime = getenv("SPHYNX_RUNTIME", None)
-        if runtime is None:
-            env = False
-            runtime = Path(__file__).parent.parent.parent / "runtime"
-        else:
-            runtime = Path(runtime)
-        if not runtime.exists():
-            if env:
-                raise GenericError(f"SPHYNX_RUNTIME environment variable set to {runtime}, but path does not exist")
-            raise GenericError(f"Runtime path {runtime} not found")
-        self.runtime = runtime
+        if self.runtime is None:
+            self.runtime = find_runtime(getenv("SPHYNX_RUNTIME", None))
+        elif not Path(self.runtime).exists():
+            raise GenericError(f"Runtime path {self.runtime} not found")
 
     def warn(self, span, message, flag=""):
-        self.warnings.append(SpanError(span, message, flag, color="\u001b[33m"))
+        self.warnings.append(SpanError(span, message, flag, color="\u001b[33m", severity="warning"))
 
     def error(self, span, message, flag=""):
         self.errors.append(SpanError(span, message, flag, color="\u001b[31m"))
 
     def print_errors(self):
-        for error in self.errors:
-            error.print_error()
+        Diagnostics().extend(self.errors).print()
 
     def print_warnings(self):
-        for warning in self.warnings:
-            warning.print_error()
+        Diagnostics().extend(self.warnings).print()
+
+    def prelude(self) -> str:
+        output = "#include \"common.h\"\n"
+        output += "\n".join([f"#include \"{name}\"" for name in runtime_headers(Path(self.runtime))])
+        output += "\n\n"
+        output += f"extern Value *spxc_ints[{small_ints}];\nextern Value *spxc_floats[{len(small_floats)}];\n\n"
+        if self.instrument:
+            output += instrumentation.header
+        return output
+
+    @staticmethod
+    def constant_definitions() -> str:
+        """Defines the tables of immortal Values, along with the function filling them."""
+        floats = "".join([
+            f"    spxc_floats[{index}] = value_new_float({value});\n" for index, value in enumerate(small_floats)
+        ])
+        return (
+            f"Value *spxc_ints[{small_ints}];\nValue *spxc_floats[{len(small_floats)}];\n\n"
+            f"static void spxc_init(void) {{\n    for (int i = 0; i < {small_ints}; i++) {{\n"
+            f"        spxc_ints[i] = value_new_int(i);\n    }}\n{floats}}}\n\n"
+        )
+
+    @staticmethod
+    def constant(node: ast.Node) -> str | None:
+        """Returns the immortal Value for a literal, if there is one."""
+        match node:
+            case ast.Integer() if 0 <= node.value < small_ints:
+                return f"spxc_ints[{node.value}]"
+            case ast.Float() if node.value in small_floats:
+                return f"spxc_floats[{small_floats.index(node.value)}]"
+        return None
+
+    def probe(self, location: Location, kind: str) -> str:
+        """Returns the probe counting a kind of event at a source location, registering it."""
+        name = instrumentation.name(location, kind)
+        self.probes.setdefault(name, (f"{self.filename}:{location.line}:{location.column}", kind))
+        return name
+
+    def probe_declarations(self, extern: bool=False) -> str:
+        if not self.instrument:
+            return ""
+        return instrumentation.declarations(self.probes, extern)
+
+    def alloc(self, code: str) -> str:
+        return f"spxi_alloc(&{self.site}, {code})" if self.instrument else code
+
+    def ref(self, code: str) -> str:
+        return f"spxi_ref(&{self.site}, {code})" if self.instrument else f"ref({code})"
+
+    def unref(self, code: str) -> str:
+        return f"spxi_unref(&{self.site}, {code})" if self.instrument else f"unref({code})"
+
+    def temporary(self, code: str) -> str:
+        index = self.temps
+        self.temps += 1
+        self.frame_temps = max(self.frame_temps, self.temps)
+        return f"(spxt_temps[{index}] = {code})"
+
+    def operand(self, node: ast.Node) -> str:
+        """Compiles an operand to be borrowed. Variables and immortal Values are used as they are."""
+        if isinstance(node, ast.VariableReference):
+            return self.local(node.name, node.binding)
+        if (constant := self.constant(node)) is not None:
+            return constant
+        return self.temporary(self.compile_node(node))
+
+    def release(self) -> list[str]:
+        """Releases the temporaries of the current statement."""
+        released = [self.unref(f"spxt_temps[{index}]") for index in range(self.temps)]
+        self.temps = 0
+        return released
+
+    def test(self, node: ast.Node) -> str:
+        """Compiles a condition, releasing its temporaries each time it is evaluated."""
+        value = self.operand(node)
+        released = self.release()
+        if not released:
+            return f"value_is_truthy({value})"
+        self.frame_tests = True
+        return f"(spxt_test = value_is_truthy({value}), {', '.join(released)}, spxt_test)"
+
+    def frame(self) -> str:
+        """Declares the temporaries used by the C function just compiled."""
+        output = f"Value *spxt_temps[{self.frame_temps}];\n" if self.frame_temps else ""
+        if self.frame_tests:
+            output += "int spxt_test;\n"
+        return output
+
+    def prototypes(self, functions: list[ast.Function]) -> str:
+        return "".join([f"{self.signature(function)};\n" for function in functions]) + "\n"
 
     def compile(self):
-        self.runtime: Path
-        self.out += "#include \"common.h\"\n"
-        self.out += "\n".join([f"#include \"{file.name}\"" for file in (self.runtime / "Types").glob("*.h")])
-        self.out += "\n".join([f"#include \"{file.name}\"" for file in (self.runtime / "Context").glob("*.h")])
-        self.out += "\n\n"
-        self.out += self.compile_block(self.program, True)
+        # Names are checked on the program as written, before passes can delete any of it
+        self.resolver.resolve(self.program)
+        if self.errors:
+            return
+        if self.optimizer.enabled:
+            self.program = self.optimizer.optimize(self.program)
+            # Bind again for the temporaries the passes declared; the program was already
+            # checked, so anything reported this time is a duplicate
+            reported = len(self.warnings)
+            self.resolver = Resolver(self)
+            self.resolver.resolve(self.program)
+            del self.warnings[reported:]
+        functions = [statement for statement in self.program.statements if isinstance(statement, ast.Function)]
+        main = ast.Block(self.program.span, [
+            statement for statement in self.program.statements if not isinstance(statement, ast.Function)
+        ])
+        units = self.compile_functions(functions)
+        body = self.compile_block(main, True)
+        # Probes are only all known once everything is generated
+        header = self.prelude() + self.prototypes(functions)
+        if self.split:
+            self.units = [
+                self.map_source(header + self.probe_declarations(True) + unit, str(unit_path(Path(self.output), n)))[0]
+                for n, unit in enumerate(units, 1)
+            ]
+            units = []
+        self.out += header + self.constant_definitions() + self.probe_declarations() + "".join(units) + body
+        if self.marking:
+            self.out, mapper = self.map_source(self.out, self.output)
+            if self.mapping:
+                self.source_map = mapper.to_json()
+
+    def map_source(self, output: str, name: str) -> tuple[str, SourceMapper]:
+        """Replaces the location markers in some output written to the file name, see SourceMapper."""
+        mapper = SourceMapper(self.filename, self.line_directives, name)
+        return mapper.feed(output) + mapper.finish(), mapper
+
+    def compile_functions(self, functions: list[ast.Function]) -> list[str]:
+        """
+        Compiles top-level functions, which are independent of each other, split into
+        up to self.jobs contiguous chunks compiled in parallel. Returns the code for
+        each chunk in program order, so the output does not depend on scheduling.
+        """
+        if not functions:
+            return []
+        size = -(-len(functions) // max(self.jobs, 1))
+        chunks = [functions[index:index + size] for index in range(0, len(functions), size)]
+        if len(chunks) == 1:
+            return ["".join([self.compile_function(function) for function in functions])]
+        with ProcessPoolExecutor(len(chunks)) as pool:
+            results = list(pool.map(compile_chunk, repeat(self.filename), repeat(self.runtime), repeat(self.marking),
+                                    repeat(self.instrument), chunks))
+        for _, probes in results:
+            self.probes.update(probes)
+        return [output for output, _ in results]
+
+    def compile_stream(self, program: Iterable[ast.Node], out: TextIO) -> None:
+        """
+        Compiles top-level statements one at a time as they are produced, so neither the
+        whole program nor its output is ever held. Functions have to come before main, so
+        both are spilled to temporary files until the end.
+        """
+        signatures = []
+        end = None
+        with TemporaryFile("w+") as functions, TemporaryFile("w+") as body:
+            self.scopes.append({})
+            for statement in program:
+                end = statement.span.end
+                self.resolver.resolve_statement(statement)
+                if self.errors or self.resolver.incomplete:
+                    # Keep resolving to report every error, but stop generating code
+                    continue
+                if isinstance(statement, ast.Function):
+                    signatures.append(f"{self.signature(statement)};\n")
+                    functions.write(self.compile_function(statement))
+                    continue
+                body.write(self.compile_statement(statement))
+                body.write("\n")
+            if self.marking and end is not None:
+                body.write(mark(end))
+            if self.instrument and end is not None:
+                self.site = self.probe(end, "scope")
+            body.write(self.close_scope())
+            self.resolver.finish()
+            if self.errors or self.resolver.incomplete:
+                return
+
+            mapper = SourceMapper(self.filename, self.line_directives, self.output)
+            out.write(mapper.feed(self.prelude()))
+            out.write(mapper.feed("".join(signatures) + "\n"))
+            out.write(mapper.feed(self.constant_definitions() + self.probe_declarations()))
+            functions.seek(0)
+            for line in functions:
+                out.write(mapper.feed(line))
+            out.write(mapper.feed("int main() {\n" + self.entry()))
+            body.seek(0)
+            for line in body:
+                out.write(mapper.feed(line))
+            out.write(mapper.finish())
+            if self.mapping:
+                self.source_map = mapper.to_json()
+
+    @staticmethod
+    def local(name: str, binding: tuple[int, int]) -> str:
+        """
+        Returns the C name of a local, unique within its function thanks to its slot. Names of
+        compiler generated variables contain a dot, which becomes an underscore.
+        """
+        return f"{name.replace('.', '_')}_{binding[1]}"
+
+    def signature(self, node: ast.Function) -> str:
+        args = ", ".join([f"Value *{self.local(arg, binding)}" for arg, binding in zip(node.args, node.bindings)])
+        return f"Value *spx_{node.name}({args or 'void'})"
+
+    def entry(self) -> str:
+        """Returns the start of main, after its temporaries are known."""
+        output = self.frame() + "spxc_init();\n"
+        if self.instrument:
+            output += "atexit(spxi_report);\n"
+        return output
+
+    def compile_function(self, node: ast.Function) -> str:
+        # Arguments are owned by the callee, and released along with its locals
+        self.scopes.append({self.local(arg, binding): node.span for arg, binding in zip(node.args, node.bindings)})
+        outer = self.frame_temps, self.frame_tests
+        self.frame_temps, self.frame_tests = 0, False
+        output = mark(node.span.start) if self.marking else ""
+        output += f"{self.signature(node)} {{\n"
+        if self.instrument:
+            # Time spent in calls is inclusive, recursive calls are counted in their callers too
+            probe = self.probe(node.span.start, "function")
+            output += f"{probe}.entries++;\nunsigned long long spxi_start = spxi_clock();\n"
+        body = self.compile_block(node.body)
+        output += self.frame() + body
+        if self.instrument:
+            self.site = probe
+        output += "\n" + "".join([f"{self.unref(name)};\n" for name in self.scopes.pop().keys()])
+        if self.instrument:
+            output += f"{probe}.time += spxi_clock() - spxi_start;\n"
+        # There is no return statement, a call evaluates to 0; the caller owns the result
+        output += f"return {self.ref('spxc_ints[0]')};\n}}\n"
+        # Whatever follows a function is generated code again, for prototypes or main
+        output += unmark() + "\n" if self.marking else "\n"
+        self.frame_temps, self.frame_tests = outer
+        return output
 
     def compile_block(self, node: ast.Block, top=False):
-        output = ""
-        if top:
-            output += "int main() "
-        output += "{\n"
+        output = "{\n"
+        site = self.site
         self.scopes.append({})
         for statement in node.statements:
-            output += self.compile_node(statement)
+            output += self.compile_statement(statement)
             output += "\n"
-        output += "\n".join([f"unref({name});" for name in self.scopes.pop().keys()])
-        output += "\n}"
+        if self.marking:
+            output += mark(node.span.end)
+        if self.instrument:
+            self.site = self.probe(node.span.end, "scope")
+        output += self.close_scope()
+        self.site = site
+        if top:
+            output = "int main() {\n" + self.entry() + output.removeprefix("{\n")
         return output
 
-    def compile_node(self, node: ast.Node):
+    def compile_statement(self, node: ast.Node) -> str:
+        output = mark(node.span.start) if self.marking else ""
+        if self.instrument:
+            self.site = self.probe(node.span.start, "statement")
+        if isinstance(node, statements):
+            output += self.compile_node(node)
+        else:
+            # The result of a bare expression is discarded
+            output += f"{self.unref(self.compile_node(node))};"
+        return output + "".join([f" {released};" for released in self.release()])
+
+    def close_scope(self) -> str:
+        return "\n".join([f"{self.unref(name)};" for name in self.scopes.pop().keys()]) + "\n}"
+
+    def compile_node(self, node: ast.Node) -> str:
+        """
+        Compiles a node. With memoization, a subtree shared by the NodeFactory which was compiled
+        before at the same temporary index and probe site reuses the same code; only shared
+        nodes are kept, so the memo grows with the distinct subtrees rather than the program.
+        Entries keep their node alive, so ids are never reused.
+        """
+        if self.memo is None or not self.factory.is_shared(node):
+            return self.generate(node)
+        memo_key = id(node), self.temps, self.site
+        entry = self.memo.get(memo_key)
+        if entry is not None and entry[0] is node:
+            self.temps += entry[2]
+            self.frame_temps = max(self.frame_temps, self.temps)
+            return entry[1]
+        start = self.temps
+        output = self.generate(node)
+        self.memo[memo_key] = node, output, self.temps - start
+        return output
+
+    def generate(self, node: ast.Node) -> str:
         match type(node):
             case ast.Block:
                 node: ast.Block
                 return self.compile_block(node)
 
+            # Control flow
+            case ast.If:
+                node: ast.If
+                output = f"if ({self.test(node.condition)}) {self.compile_block(node.body)}"
+                if node.else_body:
+                    output += f" else {self.compile_node(node.else_body)}"
+                return output
+            case ast.While:
+                node: ast.While
+                if not self.instrument:
+                    return f"while ({self.test(node.condition)}) {self.compile_block(node.body)}"
+                probe = self.probe(node.span.start, "loop")
+                condition = self.test(node.condition)
+                return (
+                    f"{{\n{probe}.entries++;\nunsigned long long spxi_loop_start = spxi_clock();\n"
+                    f"while ({condition}) {{\n{probe}.iterations++;\n{self.compile_block(node.body)}\n}}\n"
+                    f"{probe}.time += spxi_clock() - spxi_loop_start;\n}}"
+                )
+
             # Assignment
-            case ast.VariableDeclaration:
+            case ast.VariableDeclaration | ast.ConstantDeclaration:
+                # Assignments to constants are rejected by the resolver
                 node: ast.VariableDeclaration
-                self.scopes[-1][node.name] = node
-                return f"Value *{node.name} = {self.compile_node(node.value)};"
+                name = self.local(node.name, node.binding)
+                self.scopes[-1][name] = node.span
+                return f"Value *{name} = {self.compile_node(node.value)};"
             case ast.VariableAssignment:
                 node: ast.VariableAssignment
-                return f"unref({node.name}); {node.name} = {self.compile_node(node.value)};"
+                name = self.local(node.name, node.binding)
+                # The old value is released last, the new one can be computed from it
+                value = self.compile_node(node.value)
+                return f"{{ Value *spxt_old = {name}; {name} = {value}; {self.unref('spxt_old')}; }}"
             case ast.VariableReference:
                 node: ast.VariableReference
-                return f"ref({node.name})"
+                return self.ref(self.local(node.name, node.binding))
+
+            # Functions
+            case ast.Function:
+                node: ast.Function
+                raise SpanError(node.span, "Functions can only be declared at the top level")
+            case ast.Call:
+                node: ast.Call
+                if not isinstance(node.name, ast.VariableReference):
+                    raise SpanError(node.name.span, "Only functions can be called", "Expected a function name")
+                return f"spx_{node.name.name}({', '.join([self.compile_node(arg) for arg in node.args])})"
 
             # Operations
             case ast.Add:
                 node: ast.Add
-                return f"value_add({self.compile_node(node.left)}, {self.compile_node(node.right)})"
+                return f"value_add({self.operand(node.left)}, {self.operand(node.right)})"
             case ast.Subtract:
                 node: ast.Subtract
-                return f"value_subtract({self.compile_node(node.left)}, {self.compile_node(node.right)})"
+                return f"value_subtract({self.operand(node.left)}, {self.operand(node.right)})"
             case ast.Power:
                 node: ast.Power
-                return f"value_power({self.compile_node(node.left)}, {self.compile_node(node.right)})"
+                return f"value_power({self.operand(node.left)}, {self.operand(node.right)})"
             case ast.Multiply:
                 node: ast.Multiply
-                return f"value_multiply({self.compile_node(node.left)}, {self.compile_node(node.right)})"
+                return f"value_multiply({self.operand(node.left)}, {self.operand(node.right)})"
             case ast.Divide:
                 node: ast.Divide
-                return f"value_divide({self.compile_node(node.left)}, {self.compile_node(node.right)})"
+                return f"value_divide({self.operand(node.left)}, {self.operand(node.right)})"
             case ast.Modulo:
                 node: ast.Modulo
-                return f"value_modulo({self.compile_node(node.left)}, {self.compile_node(node.right)})"
+                return f"value_modulo({self.operand(node.left)}, {self.operand(node.right)})"
 
             # Comparisons
             case ast.EqualEqual:
                 node: ast.EqualEqual
-                return f"value_equals({self.compile_node(node.left)}, {self.compile_node(node.right)})"
+                return f"value_equals({self.operand(node.left)}, {self.operand(node.right)})"
             case ast.NotEqual:
                 node: ast.NotEqual
-                return f"value_not(value_equals({self.compile_node(node.left)}, {self.compile_node(node.right)}))"
+                equals = self.temporary(f"value_equals({self.operand(node.left)}, {self.operand(node.right)})")
+                return f"value_not({equals})"
             case ast.GreaterThan:
                 node: ast.GreaterThan
-                return f"value_greater_than({self.compile_node(node.left)}, {self.compile_node(node.right)})"
+                return f"value_greater_than({self.operand(node.left)}, {self.operand(node.right)})"
 
             # Literals
             case ast.Integer:
                 node: ast.Integer
-                return f"value_new_int({node.value})"
+                if (constant := self.constant(node)) is not None:
+                    return self.ref(constant)
+                return self.alloc(f"value_new_int({node.value})")
             case ast.String:
                 node: ast.String
-                return f"value_new_string({len(node.value)}, \"{node.value}\")"
+                return self.alloc(f"value_new_string({len(node.value)}, \"{node.value}\")")
             case ast.Float:
                 node: ast.Float
-                return f"value_new_float({node.value})"
+                if (constant := self.constant(node)) is not None:
+                    return self.ref(constant)
+                return self.alloc(f"value_new_float({node.value})")
 
             case _:
                 raise GenericError(f"Unhandled node type {type(node)}")
+
+
+@lru_cache
+def find_runtime(env: str | None) -> Path:
+    """Locates the runtime, once per value of the SPHYNX_RUNTIME environment variable."""
+    if env is None:
+        runtime = Path(__file__).parent.parent.parent / "runtime"
+        if not runtime.exists():
+            raise GenericError(f"Runtime path {runtime} not found")
+        return runtime
+    runtime = Path(env)
+    if not runtime.exists():
+        raise GenericError(f"SPHYNX_RUNTIME environment variable set to {runtime}, but path does not exist")
+    return runtime
+
+
+@lru_cache
+def runtime_headers(runtime: Path) -> tuple[str, ...]:
+    """Lists the runtime headers every program includes, once per runtime."""
+    return tuple(file.name for folder in ("Types", "Context") for file in sorted((runtime / folder).glob("*.h")))
+
+
+def unit_path(output: Path, n: int) -> Path:
+    """Returns where the n-th unit of a split program is written, counting from 1."""
+    return output.with_stem(f"{output.stem}_{n}")
+
+
+def compile_chunk(filename: str, runtime: Path, marking: bool, instrument: bool,
+                  functions: list[ast.Function]) -> tuple[str, dict[str, tuple[str, str]]]:
+    """
+    Compiles a chunk of top-level functions in a worker process, returning its code and probes.
+    Workers have no NodeFactory to tell shared nodes apart, so they never memoize.
+    """
+    compiler = Compiler(filename, None, runtime=runtime, source_map=marking, instrument=instrument)
+    return "".join([compiler.compile_function(function) for function in functions]), compiler.probes
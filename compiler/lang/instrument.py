@@ -0,0 +1,65 @@
+from __future__ import annotations
+
+from compiler.lang.common.location import Location
+
+
+# Shared by every translation unit of an instrumented program. Timers count CPU cycles
+# where the time stamp counter is available, and nanoseconds everywhere else.
+header = """#include <stdio.h>
+#include <stdlib.h>
+#if defined(__x86_64__) || defined(__i386__)
+#include <x86intrin.h>
+#define SPXI_UNIT "cycles"
+static inline unsigned long long spxi_clock(void) { return __rdtsc(); }
+#else
+#include <time.h>
+#define SPXI_UNIT "ns"
+static inline unsigned long long spxi_clock(void) {
+    struct timespec now;
+    clock_gettime(CLOCK_MONOTONIC, &now);
+    return (unsigned long long) now.tv_sec * 1000000000ull + (unsigned long long) now.tv_nsec;
+}
+#endif
+
+typedef struct {
+    const char *location;
+    const char *kind;
+    unsigned long long entries, iterations, time, allocations, refs, unrefs;
+} SpxiProbe;
+
+static inline Value *spxi_alloc(SpxiProbe *probe, Value *value) { probe->allocations++; return value; }
+static inline Value *spxi_ref(SpxiProbe *probe, Value *value) { probe->refs++; return ref(value); }
+static inline void spxi_unref(SpxiProbe *probe, Value *value) { probe->unrefs++; unref(value); }
+
+"""
+
+
+def name(location: Location, kind: str) -> str:
+    """Returns the C name of the probe counting a kind of event at a source location."""
+    return f"spxi_probe_{location.line}_{location.column}_{kind}"
+
+
+def declarations(probes: dict[str, tuple[str, str]], extern: bool=False) -> str:
+    """Defines the probes and the report printed at exit, or only declares the probes for other units."""
+    if extern:
+        return "".join([f"extern SpxiProbe {probe};\n" for probe in probes]) + "\n"
+    output = ""
+    for probe, (location, kind) in probes.items():
+        location = location.replace("\\", "\\\\").replace("\"", "\\\"")
+        output += f"SpxiProbe {probe} = {{\"{location}\", \"{kind}\"}};\n"
+    output += "static SpxiProbe *spxi_probes[] = {\n" + "".join([f"    &{probe},\n" for probe in probes]) + "};\n\n"
+    output += """static void spxi_report(void) {
+    fprintf(stderr, "%-32s %-10s %12s %12s %16s %12s %12s %12s\\n",
+            "location", "kind", "entries", "iterations", SPXI_UNIT, "allocations", "refs", "unrefs");
+    for (size_t i = 0; i < sizeof(spxi_probes) / sizeof(*spxi_probes); i++) {
+        SpxiProbe *probe = spxi_probes[i];
+        if (!(probe->entries || probe->allocations || probe->refs || probe->unrefs)) {
+            continue;
+        }
+        fprintf(stderr, "%-32s %-10s %12llu %12llu %16llu %12llu %12llu %12llu\\n", probe->location, probe->kind,
+                probe->entries, probe->iterations, probe->time, probe->allocations, probe->refs, probe->unrefs);
+    }
+}
+
+"""
+    return output
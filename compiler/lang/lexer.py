@@ -1,6 +1,9 @@
 from compiler.lang.common.location import Location, Span
 from compiler.lang.common.token import Token, TokenKind, characters, characters_match, keywords
 from compiler.lang.common.error import SpanError
+from typing import Iterator
+from mmap import mmap
+from sys import intern
 
 
 # Some kind of error is causing spans to be WAY off
@@ -9,13 +12,19 @@ from compiler.lang.common.error import SpanError
 # todo: fix span issue
 
 class Lexer:
-    def __init__(self, filename: str, text: str) -> None:
+    def __init__(self, filename: str, text: str | bytes | mmap) -> None:
+        """
+        Text can also be UTF-8 encoded bytes, such as a memory mapped file. Those are decoded one
+        character at a time, and token text is only decoded once sliced out of the buffer, so the
+        whole source is never decoded or copied. Location indexes are then byte offsets.
+        """
         self.filename = filename
         self.text = text
+        self.binary = not isinstance(text, str)
         self.index = 0
         self.line = 1
         self.column = 1
-        self.cur = self.text[self.index] if len(self.text) > 0 else None
+        self.cur, self.width = self.char_at(self.index)
         self.tokens = []
 
         # State
@@ -28,31 +37,47 @@ class Lexer:
     def span(self, start: Location) -> Span:
         return Span(start, self.location)
 
+    def char_at(self, index: int) -> tuple[str | None, int]:
+        """Returns the character starting at index, and its width in the text."""
+        if index >= len(self.text):
+            return None, 0
+        if not self.binary:
+            return self.text[index], 1
+        lead = self.text[index]
+        if lead < 0x80:
+            return chr(lead), 1
+        width = 2 if lead < 0xe0 else 3 if lead < 0xf0 else 4
+        return self.slice(index, index + width), width
+
+    def slice(self, start: int, end: int) -> str:
+        if not self.binary:
+            return self.text[start:end]
+        return str(self.text[start:end], "utf-8", "replace")
+
     def advance(self) -> None:
         if self.cur == "\n":
             self.line += 1
             self.column = 1
         else:
             self.column += 1
-        self.index += 1
-        if self.index >= len(self.text):
-            self.cur = None
-            return
-        self.cur = self.text[self.index]
+        self.index += self.width
+        self.cur, self.width = self.char_at(self.index)
 
     def advance_many(self, amount: int) -> None:
         for _ in range(amount):
             self.advance()
 
     def peek(self) -> str | None:
-        if self.index + 1 >= len(self.text):
-            return None
-        return self.text[self.index + 1]
+        return self.char_at(self.index + self.width)[0]
 
     def peek_slice(self, length: int) -> str | None:
-        if self.index + length >= len(self.text):
+        """
+        Returns the next length units of text, counted like Location indexes: bytes for binary
+        text, characters for str. Only ASCII symbols are looked up, where the two are the same.
+        """
+        if self.index + length > len(self.text):
             return None
-        return self.text[self.index:self.index+length]
+        return self.slice(self.index, self.index + length)
 
     def push_simple(self, kind: TokenKind, size: int=1) -> None:
         start = self.location
@@ -65,83 +90,117 @@ class Lexer:
         self.new_line = False
 
     def lex(self) -> list[Token]:
+        """Lexes the whole text, raising the first error instead of yielding it as a token."""
+        tokens = list(self.stream())
+        for token in tokens:
+            if token.kind == TokenKind.Error:
+                raise token.data
+        return tokens
+
+    def stream(self) -> Iterator[Token]:
+        """
+        Yields tokens as soon as they are lexed, instead of collecting them all. Bad input is
+        yielded as an Error token holding the SpanError, and lexing resumes right after it.
+        """
         while self.cur:
             loc = self.location
-            match self.cur:
-                case "\n":
-                    self.new_line = True
+            try:
+                self.lex_token(loc)
+            except SpanError as error:
+                # Leaves new_line alone, the token after the bad input still starts its line
+                self.tokens.append(Token(TokenKind.Error, error, error.span, self.new_line))
+                if self.index == loc.index:
                     self.advance()
-                case char if char.isspace(): self.advance()
-                case "/" if self.peek() == "/":  # Single-line comment
-                    while self.cur and self.cur != "\n":
-                        self.advance()
-                case "/" if self.peek() == "*":  # Multi-line comment
-                    while self.cur and self.peek_slice(2) != "*/":
-                        self.advance()
-                    if self.peek_slice(2) != "*/":
-                        raise SpanError(self.span(loc), "Expected '*/'")
-                    self.advance_many(2)
-                case char if char.isalpha() or char == "_": self.lex_identifier(loc)
-                case char if char.isdigit() or char == ".": self.lex_number(loc)
-                case "'" | '"': self.lex_string(loc, self.cur)
-                case char if char in characters_match:  # Symbols and operators
-                    for key in characters:
-                        if self.peek_slice(len(key)) == key:
-                            self.advance_many(len(key))
-                            self.push(characters[key], None, loc)
-                            break
-                    else:
-                        raise SpanError(self.span(loc), f"Unexpected character '{self.cur}'")
-                case _:
-                    raise SpanError(self.span(loc), f"Unexpected character '{self.cur}'")
+            yield from self.tokens
+            self.tokens.clear()
         self.push_simple(TokenKind.EOF)
-        return self.tokens
+        yield from self.tokens
+
+    def lex_token(self, loc: Location) -> None:
+        match self.cur:
+            case "\n":
+                self.new_line = True
+                self.advance()
+            case char if char.isspace(): self.advance()
+            case "/" if self.peek() == "/":  # Single-line comment
+                while self.cur and self.cur != "\n":
+                    self.advance()
+            case "/" if self.peek() == "*":  # Multi-line comment
+                while self.cur and self.peek_slice(2) != "*/":
+                    self.advance()
+                if self.peek_slice(2) != "*/":
+                    raise SpanError(self.span(loc), "Expected '*/'")
+                self.advance_many(2)
+            case char if char.isalpha() or char == "_": self.lex_identifier(loc)
+            case char if char.isdigit() or char == ".": self.lex_number(loc)
+            case "'" | '"': self.lex_string(loc, self.cur)
+            case char if char in characters_match:  # Symbols and operators
+                for key in characters:
+                    if self.peek_slice(len(key)) == key:
+                        self.advance_many(len(key))
+                        self.push(characters[key], None, loc)
+                        break
+                else:
+                    raise SpanError(self.span(loc), f"Unexpected character '{self.cur}'")
+            case _:
+                raise SpanError(self.span(loc), f"Unexpected character '{self.cur}'")
 
     def lex_identifier(self, loc) -> None:
-        identifier = ""
+        start = self.index
         while self.cur and (self.cur.isalnum() or self.cur == "_"):
-            identifier += self.cur
             self.advance()
+        identifier = intern(self.slice(start, self.index))
         kind = keywords.get(identifier, TokenKind.Identifier)
         self.push(kind, identifier, loc)
 
     def lex_number(self, loc) -> None:
-        number = ""
-        number += self.lex_integer()
+        start = self.index
+        self.lex_integer()
         if self.cur == ".":
-            number += self.cur
             self.advance()
-            number += self.lex_integer()
+            self.lex_integer()
             if self.cur == ".":
+                # Take the rest of the number, so lexing resumes after all of it
+                while self.cur and (self.cur.isdigit() or self.cur in "._"):
+                    self.advance()
                 raise SpanError(self.span(loc), "Unexpected '.'", "Floats cannot have multiple decimal points.")
-            self.push(TokenKind.Float, float(number), loc)
+            self.push(TokenKind.Float, float(self.slice(start, self.index).replace("_", "")), loc)
         else:
-            self.push(TokenKind.Integer, int(number), loc)
+            self.push(TokenKind.Integer, int(self.slice(start, self.index).replace("_", "")), loc)
 
-    def lex_integer(self):
-        out = ""
+    def lex_integer(self) -> None:
         while self.cur and self.cur.isdigit():
-            out += self.cur
             self.advance()
             while self.cur == "_":
                 self.advance()
-        return out
 
     def lex_string(self, loc, quote) -> None:
+        self.advance()
         out = ""
+        start = self.index
+        # A bad escape is only raised at the closing quote, so lexing resumes after the string
+        error = None
         while self.cur and self.cur != quote:
-            if self.cur == "\\":
+            if self.cur != "\\":
                 self.advance()
-                match self.cur:
-                    case "n": out += "\n"
-                    case "t": out += "\t"
-                    case "r": out += "\r"
-                    case "0": out += "\0"
-                    case "\\": out += "\\"
-                    case char if char==quote: out += quote
-                    case _:
-                        raise SpanError(self.span(loc), f"Unexpected escape character '{self.cur}'")
+                continue
+            out += self.slice(start, self.index)
+            self.advance()
+            match self.cur:
+                case "n": out += "\n"
+                case "t": out += "\t"
+                case "r": out += "\r"
+                case "0": out += "\0"
+                case "\\": out += "\\"
+                case char if char==quote: out += quote
+                case _:
+                    error = error or SpanError(self.span(loc), f"Unexpected escape character '{self.cur}'")
+            self.advance()
+            start = self.index
         if self.cur != quote:
             raise SpanError(self.span(loc), "Expected closing quote")
+        out += self.slice(start, self.index)
         self.advance()
+        if error:
+            raise error
         self.push(TokenKind.String, out, loc)
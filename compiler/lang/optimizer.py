@@ -0,0 +1,53 @@
+from __future__ import annotations
+from typing import TYPE_CHECKING
+
+from compiler.lang.passes.dce import DeadCodeElimination
+from compiler.lang.passes.strength import StrengthReduction
+from compiler.lang.passes.licm import LoopInvariantCodeMotion
+from compiler.lang.passes.cse import CommonSubexpressionElimination
+import compiler.lang.common.ast as ast
+
+if TYPE_CHECKING:
+    from compiler.lang.compiler import Compiler
+
+
+# (minimum level, pass) in the order the passes run
+passes = [
+    (1, DeadCodeElimination),
+    (1, StrengthReduction),
+    (1, LoopInvariantCodeMotion),
+    (1, CommonSubexpressionElimination),
+]
+
+
+class Optimizer:
+    def __init__(self, compiler: Compiler, level: int=0) -> None:
+        self.compiler = compiler
+        self.level = level
+        self.report = []
+        self.temporaries = 0
+
+    @property
+    def enabled(self) -> bool:
+        return any(self.level >= level for level, _ in passes)
+
+    def temporary(self, prefix: str) -> str:
+        """
+        Returns a fresh name for a compiler generated variable. It contains a dot, which no
+        identifier in the source can, so it never collides with or shadows a user variable.
+        """
+        self.temporaries += 1
+        return f"{prefix}.{self.temporaries}"
+
+    def note(self, message: str) -> None:
+        """Records a line for the verbose optimization report."""
+        self.report.append(message)
+
+    def optimize(self, program: ast.Block) -> ast.Block:
+        if self.enabled and self.compiler.factory:
+            # Passes rewrite nodes in place, which must not leak into other uses of a shared subtree
+            program = self.compiler.factory.expand(program)
+        for level, optimization in passes:
+            if self.level >= level:
+                program = optimization(self).run(program)
+        return program
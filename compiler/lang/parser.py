@@ -1,19 +1,39 @@
 from compiler.lang.common.token import Token, TokenKind
 from compiler.lang.common.error import SpanError
+from compiler.lang.common.factory import NodeFactory
 import compiler.lang.common.ast as ast
+from typing import Iterable, Iterator
 
 
 class Parser:
-    def __init__(self, filename: str, tokens: list[Token]):
+    def __init__(self, filename: str, tokens: Iterable[Token], factory: NodeFactory | None=None):
         self.filename = filename
-        self.tokens = tokens
+        self.tokens = iter(tokens)
         self.index = 0
-        self.current = self.tokens[self.index]
+        self.errors: list[SpanError] = []
+        # Index of the latest Error token from the lexer, the statement around it is broken
+        self.lexer_error: int | None = None
+        # A declaration whose value failed to parse, kept so later statements can still see the name
+        self.partial: ast.Node | None = None
+        self.current = self.next_token()
+        # Shares identical subtrees of each top-level statement once it is complete
+        self.factory = factory
+
+    def next_token(self) -> Token:
+        """
+        Takes the next token. Errors the lexer yields are recorded, but the token is left in
+        place so the statement around the bad input fails to parse rather than running on.
+        """
+        token = next(self.tokens)
+        if token.kind == TokenKind.Error:
+            self.errors.append(token.data)
+            self.lexer_error = self.index
+        return token
 
     def advance(self) -> None:
         if self.current.kind != TokenKind.EOF:
             self.index += 1
-            self.current = self.tokens[self.index]
+            self.current = self.next_token()
 
     def consume(self, kind: TokenKind, msg: str=None) -> Token:
         if self.current.kind == kind:
@@ -28,10 +48,62 @@ class Parser:
                 and not self.current.new_line_before \
                 and self.current.kind != TokenKind.EOF:
             raise SpanError(self.current.span, f"Expected line end, got {self.current.kind}", msg)
+        if self.current.kind == TokenKind.Semicolon:
+            self.advance()
+
+    def recover(self, error: SpanError, index: int) -> None:
+        """
+        Records a syntax error and skips to the start of the next statement: the next token
+        on a new line or after a semicolon, outside any braces opened in the meantime.
+        Stops before a closing brace of the enclosing block.
+        """
+        if self.lexer_error is None or self.lexer_error < index:
+            # Otherwise the statement contains bad input, which was already reported
+            self.errors.append(error)
+        if self.index == index and self.current.kind != TokenKind.EOF:
+            # Nothing was consumed, skip the offending token so parsing makes progress
+            self.advance()
+        depth = 0
+        while self.current.kind != TokenKind.EOF:
+            match self.current.kind:
+                case TokenKind.LeftBrace:
+                    depth += 1
+                case TokenKind.RightBrace if depth == 0:
+                    return
+                case TokenKind.RightBrace:
+                    depth -= 1
+                case TokenKind.Semicolon if depth == 0:
+                    self.advance()
+                    return
+                case _ if depth == 0 and self.current.new_line_before:
+                    return
+            self.advance()
+
+    def intern(self, statement: ast.Node) -> ast.Node:
+        return self.factory.intern(statement) if self.factory else statement
 
     def parse(self):
+        """Parses the whole program, recovering from syntax errors, which are collected in self.errors."""
         return self.parse_block(True)
 
+    def parse_stream(self) -> Iterator[ast.Node]:
+        """Yields the top-level statements one at a time, as soon as each is parsed."""
+        while self.current.kind != TokenKind.EOF:
+            index = self.index
+            try:
+                statement = self.parse_statement()
+            except SpanError as error:
+                self.recover(error, index)
+                if self.partial:
+                    yield self.partial
+                    self.partial = None
+                continue
+            yield self.intern(statement)
+            try:
+                self.consume_line_end()
+            except SpanError as error:
+                self.recover(error, index)
+
     def parse_block(self, top: bool=False):
         start = self.current.span
         if not top:
@@ -40,9 +112,17 @@ class Parser:
         else:
             end = TokenKind.EOF
         statements = []
-        while self.current.kind != end:
-            statements.append(self.parse_statement())
-            self.consume_line_end()
+        while self.current.kind not in (end, TokenKind.EOF):
+            index = self.index
+            try:
+                statement = self.parse_statement()
+                statements.append(self.intern(statement) if top else statement)
+                self.consume_line_end()
+            except SpanError as error:
+                self.recover(error, index)
+                if self.partial:
+                    statements.append(self.partial)
+                    self.partial = None
         end = self.consume(end)
         return ast.Block(start.extend(end.span), statements)
 
@@ -86,6 +166,7 @@ class Parser:
             parameters.append(self.consume(TokenKind.Identifier).data)
             if self.current.kind != TokenKind.Comma:
                 break
+            self.advance()
         self.consume(TokenKind.RightParen, "Maybe you forgot a comma?")
         body = self.parse_block()
         return ast.Function(start.extend(body.span), name, parameters, body)
@@ -95,7 +176,10 @@ class Parser:
         self.advance()
         name = self.consume(TokenKind.Identifier).data
         self.consume(TokenKind.Equal)
+        invalid = ast.Invalid(self.current.span)
+        self.partial = ast.ConstantDeclaration(start.extend(invalid.span), name, invalid)
         value = self.parse_expression()
+        self.partial = None
         return ast.ConstantDeclaration(start.extend(value.span), name, value)
 
     def parse_let(self):
@@ -103,7 +187,10 @@ class Parser:
         self.advance()
         name = self.consume(TokenKind.Identifier).data
         self.consume(TokenKind.Equal)
+        invalid = ast.Invalid(self.current.span)
+        self.partial = ast.VariableDeclaration(start.extend(invalid.span), name, invalid)
         value = self.parse_expression()
+        self.partial = None
         return ast.VariableDeclaration(start.extend(value.span), name, value)
 
     def parse_expression(self):
@@ -175,13 +262,16 @@ class Parser:
 
     def parse_multiplicative(self):
         left = self.parse_prefix()
-        while self.current.kind in [TokenKind.Star, TokenKind.Slash]:
+        while self.current.kind in [TokenKind.Star, TokenKind.Slash, TokenKind.Percent]:
             if self.current.kind == TokenKind.Star:
                 self.advance()
                 left = ast.Multiply(left, self.parse_prefix())
             elif self.current.kind == TokenKind.Slash:
                 self.advance()
                 left = ast.Divide(left, self.parse_prefix())
+            elif self.current.kind == TokenKind.Percent:
+                self.advance()
+                left = ast.Modulo(left, self.parse_prefix())
         return left
 
     def parse_prefix(self):
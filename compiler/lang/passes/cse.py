@@ -0,0 +1,85 @@
+from __future__ import annotations
+from typing import TYPE_CHECKING
+
+from compiler.lang.common.analysis import children, map_children, key, is_pure, references, assignments, \
+    compound_statements
+import compiler.lang.common.ast as ast
+
+if TYPE_CHECKING:
+    from compiler.lang.optimizer import Optimizer
+
+
+class CommonSubexpressionElimination:
+    """
+    Computes each repeated pure subexpression of a basic block once, into a temporary
+    declared right before its first use. Expressions are keyed on their structure and
+    on the assignment version of every variable they read, so an assignment to any of
+    those variables starts a new, unrelated expression.
+    """
+    def __init__(self, optimizer: Optimizer) -> None:
+        self.optimizer = optimizer
+
+    def run(self, program: ast.Block) -> ast.Block:
+        return self.visit(program)
+
+    def visit(self, node: ast.Node) -> ast.Node:
+        map_children(node, self.visit)
+        if isinstance(node, ast.Block):
+            self.eliminate(node)
+        return node
+
+    def eliminate(self, block: ast.Block) -> None:
+        versions: dict[str, int] = {}
+        keys: dict[int, tuple[ast.Node, tuple]] = {}
+        counts: dict[tuple, int] = {}
+
+        # Number every candidate expression
+        for statement in block.statements:
+            if isinstance(statement, compound_statements):
+                self.bump(versions, assignments(statement))
+                continue
+            assigned = assignments(statement)
+            for node in self.candidates(statement, assigned):
+                vkey = key(node), tuple(sorted((name, versions.get(name, 0)) for name in references(node)))
+                keys[id(node)] = node, vkey
+                counts[vkey] = counts.get(vkey, 0) + 1
+            self.bump(versions, assigned)
+
+        repeated = {vkey for vkey, count in counts.items() if count > 1}
+        if not repeated:
+            return
+
+        # Replace repeated expressions with their temporary
+        temporaries: dict[tuple, str] = {}
+        statements = []
+
+        def replace(node: ast.Node) -> ast.Node:
+            vkey = keys.get(id(node), (None, None))[1]
+            map_children(node, replace)
+            if vkey not in repeated:
+                return node
+            if vkey not in temporaries:
+                temporaries[vkey] = self.optimizer.temporary("cse")
+                statements.append(ast.VariableDeclaration(node.span, temporaries[vkey], node))
+            return ast.VariableReference(node.span, temporaries[vkey])
+
+        for statement in block.statements:
+            if not isinstance(statement, compound_statements):
+                statement = replace(statement)
+            statements.append(statement)
+        block.statements = statements
+        self.optimizer.note(f"cse: {len(temporaries)} temporaries in block at {block.span}")
+
+    def candidates(self, node: ast.Node, assigned: set[str]):
+        """Yields the pure operations within a statement, innermost first."""
+        # The right operand of a logical operator may never be evaluated
+        operands = [node.left] if isinstance(node, (ast.LogicalAnd, ast.LogicalOr)) else children(node)
+        for child in operands:
+            yield from self.candidates(child, assigned)
+        if isinstance(node, ast.BinaryOp) and is_pure(node) and not references(node) & assigned:
+            yield node
+
+    @staticmethod
+    def bump(versions: dict[str, int], names: set[str]) -> None:
+        for name in names:
+            versions[name] = versions.get(name, 0) + 1
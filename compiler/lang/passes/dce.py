@@ -0,0 +1,86 @@
+from __future__ import annotations
+from typing import TYPE_CHECKING
+
+from compiler.lang.common.analysis import map_children, is_pure, references, assignments, compound_statements
+import compiler.lang.common.ast as ast
+
+if TYPE_CHECKING:
+    from compiler.lang.optimizer import Optimizer
+
+
+declarations = (ast.VariableDeclaration, ast.ConstantDeclaration)
+
+
+class DeadCodeElimination:
+    """
+    Removes branches behind constant conditions, pure expression statements, and stores
+    and declarations whose values are never read, found by backward liveness within each
+    block. Unreachable code and discarded results are warned about; unused variables are
+    already reported by the resolver, so their removal is only noted.
+    """
+    def __init__(self, optimizer: Optimizer) -> None:
+        self.optimizer = optimizer
+
+    def run(self, program: ast.Block) -> ast.Block:
+        return self.visit(program)
+
+    def warn(self, span, message, flag="") -> None:
+        self.optimizer.compiler.warn(span, message, flag)
+        self.optimizer.note(f"dce: {message} at {span}")
+
+    def visit(self, node: ast.Node) -> ast.Node | None:
+        map_children(node, self.visit)
+        match node:
+            case ast.If() if isinstance(node.condition, ast.Literal):
+                if node.condition.value:
+                    if node.else_body:
+                        self.warn(node.else_body.span, "Unreachable branch", "Condition is always true")
+                    return node.body
+                self.warn(node.body.span, "Unreachable branch", "Condition is always false")
+                return node.else_body
+            case ast.While() if isinstance(node.condition, ast.Literal) and not node.condition.value:
+                self.warn(node.span, "Unreachable loop", "Condition is always false")
+                return None
+            case ast.Block():
+                node.statements = [statement for statement in node.statements if statement is not None]
+                self.eliminate(node)
+        return node
+
+    def eliminate(self, block: ast.Block) -> None:
+        statements = []
+        for statement in block.statements:
+            if isinstance(statement, ast.Block) and not statement.statements:
+                continue
+            if not isinstance(statement, compound_statements) and is_pure(statement):
+                self.warn(statement.span, "Unused expression result", "Expression has no effect")
+                continue
+            statements.append(statement)
+
+        # Variables declared elsewhere may be read after the block, or by the next iteration
+        # of a loop, so only stores to the block's own variables can be dead
+        local = {statement.name for statement in statements if isinstance(statement, declarations)}
+        changed = True
+        while changed:
+            # Removing a statement can make the stores it read from dead too
+            changed = False
+            live: set[str] = set()
+            used: set[str] = set()
+            kept = []
+            for statement in reversed(statements):
+                stored = isinstance(statement, declarations + (ast.VariableAssignment,)) \
+                    and statement.name in local and is_pure(statement.value)
+                if stored and statement.name not in live:
+                    # A declaration still has to stay while later statements use the name
+                    if isinstance(statement, ast.VariableAssignment) or statement.name not in used:
+                        self.optimizer.note(f"dce: removed dead store to '{statement.name}' at {statement.span}")
+                        changed = True
+                        continue
+                kept.append(statement)
+                if isinstance(statement, declarations + (ast.VariableAssignment,)) and statement.name in local:
+                    live.discard(statement.name)
+                    live |= references(statement.value)
+                else:
+                    live |= references(statement)
+                used |= references(statement) | assignments(statement)
+            statements = kept[::-1]
+        block.statements = statements
@@ -0,0 +1,66 @@
+from __future__ import annotations
+from typing import TYPE_CHECKING
+
+from compiler.lang.common.analysis import map_children, key, is_pure, references, assignments, infer_types, cannot_fail
+import compiler.lang.common.ast as ast
+
+if TYPE_CHECKING:
+    from compiler.lang.optimizer import Optimizer
+
+
+class LoopInvariantCodeMotion:
+    """
+    Hoists pure expressions which only read variables the loop never assigns
+    out of while loops, into temporaries declared right before the loop. The body
+    may not run at all, so expressions from it are only hoisted if they cannot fail.
+    """
+    def __init__(self, optimizer: Optimizer) -> None:
+        self.optimizer = optimizer
+        self.types = {}
+
+    def run(self, program: ast.Block) -> ast.Block:
+        self.types = infer_types(program)
+        return self.visit(program)
+
+    def visit(self, node: ast.Node) -> ast.Node:
+        map_children(node, self.visit)
+        if isinstance(node, ast.Block):
+            statements = []
+            for statement in node.statements:
+                if isinstance(statement, ast.While):
+                    statements.extend(self.hoist(statement))
+                statements.append(statement)
+            node.statements = statements
+        return node
+
+    def hoist(self, loop: ast.While) -> list[ast.Node]:
+        """Rewrites a loop in place, returning the declarations for its pre-header."""
+        variant = assignments(loop)
+        temporaries: dict = {}
+        header = []
+
+        def replace(node: ast.Node, always: bool) -> ast.Node:
+            if isinstance(node, (ast.While, ast.Function)):
+                # Inner loops were already hoisted into their own pre-header
+                return node
+            if self.invariant(node, variant, always):
+                node_key = key(node)
+                if node_key not in temporaries:
+                    temporaries[node_key] = self.optimizer.temporary("licm")
+                    header.append(ast.VariableDeclaration(node.span, temporaries[node_key], node))
+                    self.optimizer.note(f"licm: hoisted {node} out of loop at {loop.span}")
+                return ast.VariableReference(node.span, temporaries[node_key])
+            conditional = isinstance(node, (ast.If, ast.LogicalAnd, ast.LogicalOr))
+            return map_children(node, lambda child: replace(child, always and not conditional))
+
+        loop.condition = replace(loop.condition, True)
+        loop.body = map_children(loop.body, lambda child: replace(child, False))
+        return header
+
+    def invariant(self, node: ast.Node, variant: set[str], always: bool) -> bool:
+        if not isinstance(node, (ast.String, ast.BinaryOp, ast.UnaryOp)) or not is_pure(node):
+            return False
+        if references(node) & variant:
+            return False
+        # Expressions the loop would not have evaluated must not raise errors before it
+        return always or cannot_fail(node, self.types)
@@ -0,0 +1,61 @@
+from __future__ import annotations
+from copy import deepcopy
+from typing import TYPE_CHECKING
+
+from compiler.lang.common.analysis import map_children, is_pure, infer_types, type_of, uint, integer, numeric
+import compiler.lang.common.ast as ast
+
+if TYPE_CHECKING:
+    from compiler.lang.optimizer import Optimizer
+
+
+class StrengthReduction:
+    """
+    Replaces operations on a constant operand with cheaper equivalents: small powers
+    become multiplication chains, and multiplication by 0 or 1 is folded. Rewrites
+    which could change the result for other types need the operand's type to be known
+    statically. Division and modulo are left alone, the runtime has no cheaper
+    operations for them.
+    """
+    def __init__(self, optimizer: Optimizer) -> None:
+        self.optimizer = optimizer
+        self.types = {}
+
+    def run(self, program: ast.Block) -> ast.Block:
+        self.types = infer_types(program)
+        return self.visit(program)
+
+    def visit(self, node: ast.Node) -> ast.Node:
+        map_children(node, self.visit)
+        reduced = self.reduce(node)
+        if reduced is not node:
+            self.optimizer.note(f"strength: {node} -> {reduced} at {node.span}")
+        return reduced
+
+    def reduce(self, node: ast.Node) -> ast.Node:
+        if not isinstance(node, (ast.Power, ast.Multiply)):
+            return node
+        if isinstance(node.right, ast.Integer):
+            value, constant = node.left, node.right.value
+        elif isinstance(node, ast.Multiply) and isinstance(node.left, ast.Integer):
+            # Multiplication of numbers is commutative, every rewrite below requires numbers
+            value, constant = node.right, node.left.value
+        else:
+            return node
+        kind = type_of(value, self.types)
+
+        match node:
+            case ast.Power() if kind in numeric and is_pure(value) and constant in (2, 3):
+                out = ast.Multiply(value, deepcopy(value))
+                if constant == 3:
+                    out = ast.Multiply(out, deepcopy(value))
+                # The chain stands for the whole power, not just its base
+                out.span = node.span
+                return out
+            case ast.Power() if kind in numeric and constant == 1:
+                return value
+            case ast.Multiply() if kind in numeric and constant == 1:
+                return value
+            case ast.Multiply() if kind in (uint, integer) and is_pure(value) and constant == 0:
+                return ast.Integer(node.span, 0)
+        return node
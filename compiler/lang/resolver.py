@@ -0,0 +1,186 @@
+from __future__ import annotations
+from sys import intern
+from typing import TYPE_CHECKING
+
+from compiler.lang.common.location import Span
+import compiler.lang.common.ast as ast
+
+if TYPE_CHECKING:
+    from compiler.lang.compiler import Compiler
+
+
+def concrete(base: type) -> frozenset[type]:
+    """Returns every instantiable node class derived from base."""
+    classes, pending = set(), [base]
+    while pending:
+        cls = pending.pop()
+        pending.extend(cls.__subclasses__())
+        if not getattr(cls, "__abstractmethods__", None):
+            classes.add(cls)
+    return frozenset(classes)
+
+
+# Node classes derive from ABC, which makes isinstance checks slow; visit looks up the
+# exact type of each node in these sets instead.
+binary_operations = concrete(ast.BinaryOp)
+unary_operations = concrete(ast.UnaryOp)
+literals = concrete(ast.Literal)
+
+
+class Scope:
+    def __init__(self, parent: Scope | None=None) -> None:
+        self.parent = parent
+        self.names: dict[str, int] = {}
+        self.constants: set[str] = set()
+        self.spans: dict[str, Span] = {}
+        self.read: set[str] = set()
+        # Names whose value failed to parse, nothing more is reported about them
+        self.poisoned: set[str] = set()
+
+    def lookup(self, name: str) -> tuple[Scope, int, int] | None:
+        """Returns the declaring scope, how many scopes up it is, and the slot of a name."""
+        scope, depth = self, 0
+        while scope is not None:
+            if name in scope.names:
+                return scope, depth, scope.names[name]
+            scope, depth = scope.parent, depth + 1
+        return None
+
+
+class Resolver:
+    """
+    Binds every variable to the declaration it refers to, annotating declarations and
+    references with a (depth, slot) binding: how many scopes up the declaration is, and
+    its index among the locals of the enclosing function (or main). Slots are unique
+    within a function, so code generation can name locals by slot and never worry about
+    shadowing. Undefined, redeclared, shadowed and unused names are reported through the
+    compiler.
+    """
+    def __init__(self, compiler: Compiler) -> None:
+        self.compiler = compiler
+        self.functions: dict[str, Span] = {}
+        self.calls: list[tuple[str, Span]] = []
+        # How many times each node shared by the compiler's NodeFactory was visited so far
+        self.visits: dict[int, int] = {}
+        self.scope = Scope()
+        self.slots = 0
+        # Set once a poisoned name is declared, the program has syntax errors and can't be generated
+        self.incomplete = False
+
+    def resolve(self, program: ast.Block) -> None:
+        for statement in program.statements:
+            self.resolve_statement(statement)
+        self.finish()
+
+    def resolve_statement(self, node: ast.Node) -> None:
+        """Resolves a single top-level statement, for compiling one at a time."""
+        self.visit(node)
+
+    def finish(self) -> None:
+        # Functions can be called before they are declared, so calls are only checked at the end
+        for name, span in self.calls:
+            if name not in self.functions:
+                self.compiler.error(span, f"Undefined function '{name}'")
+        self.close(self.scope)
+
+    def close(self, scope: Scope) -> None:
+        for name, span in scope.spans.items():
+            if name not in scope.read and name not in scope.poisoned:
+                self.compiler.warn(span, f"Unused variable '{name}'", "Variable is never read")
+
+    def declare(self, name: str, span: Span, constant: bool=False) -> tuple[int, int]:
+        name = intern(name)
+        if name in self.scope.names:
+            self.compiler.error(span, f"Variable '{name}' is already declared in this scope")
+        elif self.scope.lookup(name):
+            self.compiler.warn(span, f"Variable '{name}' shadows an outer variable")
+        self.scope.names[name] = self.slots
+        self.scope.spans[name] = span
+        if constant:
+            self.scope.constants.add(name)
+        self.slots += 1
+        return 0, self.scope.names[name]
+
+    def bind(self, name: str, span: Span, store: bool=False) -> tuple[int, int] | None:
+        found = self.scope.lookup(intern(name))
+        if found is None:
+            self.compiler.error(span, f"Undefined variable '{name}'")
+            return None
+        scope, depth, slot = found
+        if store and name in scope.constants:
+            self.compiler.error(span, f"Cannot assign to constant '{name}'")
+        if not store:
+            scope.read.add(name)
+        return depth, slot
+
+    def span(self, call: ast.Call) -> Span:
+        """
+        Returns where a call is reported. A shared call stands for several in the source, which
+        are visited in the order they were parsed, so each visit is reported at its own one.
+        """
+        factory = self.compiler.factory
+        if factory is None or not factory.is_shared(call):
+            return call.name.span
+        occurrence = self.visits.get(id(call), 0)
+        self.visits[id(call)] = occurrence + 1
+        return factory.occurrences(call)[occurrence]
+
+    def visit(self, node: ast.Node) -> None:
+        kind = type(node)
+        if kind in binary_operations:
+            self.visit(node.left)
+            self.visit(node.right)
+            return
+        if kind in unary_operations:
+            self.visit(node.value)
+            return
+        if kind in literals:
+            return
+        match kind:
+            case ast.Block:
+                self.scope = Scope(self.scope)
+                for statement in node.statements:
+                    self.visit(statement)
+                self.close(self.scope)
+                self.scope = self.scope.parent
+            case ast.If:
+                self.visit(node.condition)
+                self.visit(node.body)
+                if node.else_body:
+                    self.visit(node.else_body)
+            case ast.While:
+                self.visit(node.condition)
+                self.visit(node.body)
+            case ast.Function:
+                if node.name in self.functions:
+                    self.compiler.error(node.span, f"Function '{node.name}' is already declared")
+                self.functions[intern(node.name)] = node.span
+                # Functions get their own frame, they can't see the locals of main
+                outer, slots = self.scope, self.slots
+                self.scope, self.slots = Scope(), 0
+                node.bindings = [self.declare(arg, node.span) for arg in node.args]
+                # Arguments are part of the signature, callers pass them whether they are read or not
+                self.scope.read.update(node.args)
+                self.visit(node.body)
+                self.scope, self.slots = outer, slots
+            case ast.VariableDeclaration | ast.ConstantDeclaration:
+                self.visit(node.value)
+                node.binding = self.declare(node.name, node.span, isinstance(node, ast.ConstantDeclaration))
+                if type(node.value) is ast.Invalid:
+                    self.scope.poisoned.add(node.name)
+                    self.incomplete = True
+            case ast.Invalid:
+                # The parser already reported why
+                pass
+            case ast.VariableAssignment:
+                self.visit(node.value)
+                node.binding = self.bind(node.name, node.span, store=True)
+            case ast.VariableReference:
+                node.binding = self.bind(node.name, node.span)
+            case ast.Call:
+                if type(node.name) is ast.VariableReference:
+                    self.calls.append((intern(node.name.name), self.span(node)))
+                else:
+                    self.visit(node.name)
+                for arg in node.args:
+                    self.visit(arg)
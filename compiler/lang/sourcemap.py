@@ -0,0 +1,76 @@
+from __future__ import annotations
+from json import dumps
+
+from compiler.lang.common.location import Location
+
+
+# Code generation tags every statement with a marker line holding its source location,
+# and marks where code with no source location starts again. SourceMapper then replaces
+# the markers with #line directives, or drops them, and records which generated line
+# each location ends up on.
+marker = "#spx"
+end_marker = f"{marker} end"
+
+
+def mark(location: Location) -> str:
+    return f"{marker} {location.line} {location.column}\n"
+
+
+def unmark() -> str:
+    return f"{end_marker}\n"
+
+
+def quote(filename: str) -> str:
+    return "\"" + filename.replace("\\", "\\\\").replace("\"", "\\\"") + "\""
+
+
+class SourceMapper:
+    def __init__(self, filename: str, line_directives: bool=False, output: str | None=None) -> None:
+        """Output is the name of the generated file, which #line directives point back to after a marked region."""
+        self.filename = filename
+        self.line_directives = line_directives
+        self.output = output
+        self.line = 1
+        self.pending: tuple[int, int] | None = None
+        self.mappings: list[tuple[int, int, int]] = []
+        self.rest = ""
+
+    def feed(self, text: str) -> str:
+        """Replaces the markers in the next piece of output, which can end mid line."""
+        lines = (self.rest + text).split("\n")
+        self.rest = lines.pop()
+        out = []
+        for line in lines:
+            if line == end_marker:
+                self.pending = None
+                if not self.line_directives or self.output is None:
+                    continue
+                # The directive numbers the line after it
+                line = f"#line {self.line + 1} {quote(self.output)}"
+            elif line.startswith(marker + " "):
+                source_line, column = map(int, line.split()[1:])
+                self.pending = source_line, column
+                if not self.line_directives:
+                    continue
+                line = f"#line {source_line} {quote(self.filename)}"
+            elif self.pending is not None and line.strip():
+                self.mappings.append((self.line, *self.pending))
+                self.pending = None
+            out.append(line)
+            self.line += 1
+        return "".join([line + "\n" for line in out])
+
+    def finish(self) -> str:
+        """Returns whatever output is left after the last newline."""
+        rest, self.rest = self.rest, ""
+        return rest
+
+    def to_json(self) -> str:
+        return dumps({
+            "version": 1,
+            "source": self.filename,
+            "mappings": [
+                {"generated_line": generated, "line": line, "column": column}
+                for generated, line, column in self.mappings
+            ],
+        })
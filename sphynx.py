@@ -1,59 +1,161 @@
 import argparse
 import pathlib
+from mmap import mmap, ACCESS_READ
 from rich import print
 from time import perf_counter
 
 import compiler.lang.common.error
 from compiler import __version__, __author__, __license__  # noqa
 from compiler.lang import lexer as _lexer, parser as _parser, compiler as _compiler
+from compiler.lang.common import serialize
+from compiler.lang.common.diagnostics import Diagnostics
+from compiler.lang.common.factory import NodeFactory
+
+
+
+def positive(text: str) -> int:
+    value = int(text)
+    if value < 1:
+        raise argparse.ArgumentTypeError(f"must be at least 1, got {value}")
+    return value
+
 
 argparser = argparse.ArgumentParser(description="Compiler for Sphynx-Language (.spx)")
 argparser.add_argument("file", type=str, help="The file to compile")
 argparser.add_argument("-dcg", "--disable-code-gen", action="store_true", help="Don't generate code for the output file.")
 argparser.add_argument("-n", "--no-compile", action="store_true", help="Don't compile the output file.")
+argparser.add_argument("-O", "--optimize", type=int, default=0, choices=[0, 1], help="Optimization level")
 argparser.add_argument("-o", "--output", type=str, help="The output file")
+argparser.add_argument("--dump-tokens", type=str, help="Writes the token stream to a binary file")
+argparser.add_argument("--dump-ast", type=str, help="Writes the parsed program to a binary file")
+argparser.add_argument("-j", "--jobs", type=int, default=1, help="Number of processes generating code for functions")
+argparser.add_argument("--split", action="store_true", help="Writes the functions of each job to their own output file")
+argparser.add_argument("-s", "--stream", action="store_true", help="Compiles one top-level statement at a time, keeping memory use low")
+argparser.add_argument("-g", "--line-directives", action="store_true", help="Emits #line directives pointing at the .spx source, for profilers and debuggers")
+argparser.add_argument("--source-map", action="store_true", help="Writes a JSON map from generated lines to source lines next to the output")
+argparser.add_argument("--instrument", action="store_true", help="Counts calls, loop iterations, time and allocations per source location, reported at exit")
+argparser.add_argument("--hash-cons", action="store_true", help="Shares identical constant subexpressions and calls with constant arguments, and reuses their generated code")
+argparser.add_argument("--max-errors", type=positive, help="Shows at most this many errors, warnings are always shown")
+argparser.add_argument("--diagnostics-json", type=str, help="Also writes the errors and warnings to a JSON file")
 argparser.add_argument("-v", "--verbose", action="store_true", help="Prints extra information during compilation")
-args = argparser.parse_args()
-
-file = pathlib.Path(args.file)
-if not file.exists():
-    raise FileNotFoundError(f"File {file} does not exist")
-if not args.output:
-    args.output = file.with_suffix(".c")
-output = pathlib.Path(args.output)
-if not output.cwd().exists():
-    raise FileNotFoundError(f"Directory {output.cwd()} does not exist")
-
-print(f"Sphynx Compiler v{__version__} by {__author__} ({__license__})")
-print(f"Compiling {file} to {output}")
-start = perf_counter()
-
-with open(file, "r") as f:
-    source = f.read()
-
-try:
-    lexer = _lexer.Lexer(str(file), source)
-    tokens = lexer.lex()
-    if args.verbose:
-        print(f"Lexed in {perf_counter() - start:.4f}s")
-        print(tokens)
-    parser = _parser.Parser(str(file), tokens)
-    ast = parser.parse()
-except compiler.lang.common.error.SphynxError as e:
-    e.print_error()
-    exit(1)
-if args.verbose:
-    print(f"Parsed in {perf_counter() - start:.4f}s")
-    print(ast)
-
-if not args.disable_code_gen:
+
+
+def main(argv: list[str] | None=None) -> None:
+    args = argparser.parse_args(argv)
+    if args.stream and (args.optimize or args.jobs > 1 or args.split or args.dump_tokens or args.dump_ast or args.disable_code_gen
+                        or args.hash_cons):
+        argparser.error("--stream cannot be combined with -O, -j, --split, -dcg, --dump-tokens, --dump-ast or --hash-cons")
+
+    file = pathlib.Path(args.file)
+    if not file.exists():
+        raise FileNotFoundError(f"File {file} does not exist")
+    if not args.output:
+        args.output = file.with_suffix(".c")
+    output = pathlib.Path(args.output)
+    if not output.cwd().exists():
+        raise FileNotFoundError(f"Directory {output.cwd()} does not exist")
+
+    diagnostics = Diagnostics(args.max_errors)
+
+    def report() -> None:
+        """Prints every diagnostic collected so far at once, exiting if any of them is an error."""
+        diagnostics.print()
+        if args.diagnostics_json:
+            with open(args.diagnostics_json, "w") as f:
+                f.write(diagnostics.to_json())
+        if diagnostics.errors:
+            exit(1)
+
+    print(f"Sphynx Compiler v{__version__} by {__author__} ({__license__})")
+    print(f"Compiling {file} to {output}")
+    start = perf_counter()
+
+    factory = NodeFactory() if args.hash_cons else None
+
+    with open(file, "rb") as f:
+        # The lexer decodes straight from the mapping, the file is never read as a whole
+        source = mmap(f.fileno(), 0, access=ACCESS_READ) if file.stat().st_size else b""
+
     try:
-        comp = _compiler.Compiler(str(file), ast)
-        comp.compile()
-    except compiler.lang.common.error.SphynxError as e:
-        e.print_error()
-        exit(1)
-    if args.verbose:
-        print(f"Compiled in {perf_counter() - start:.4f}s")
-        print(comp.out)
-print(f"Finished in {perf_counter() - start:.4f}s")
+        if args.stream:
+            try:
+                lexer = _lexer.Lexer(str(file), source)
+                parser = _parser.Parser(str(file), lexer.stream(), factory)
+                comp = _compiler.Compiler(str(file), None, line_directives=args.line_directives, source_map=args.source_map,
+                                          instrument=args.instrument, factory=factory, output=str(output))
+                with open(output, "w") as f:
+                    comp.compile_stream(parser.parse_stream(), f)
+                if comp.source_map:
+                    with open(output.with_suffix(".map.json"), "w") as f:
+                        f.write(comp.source_map)
+                diagnostics.extend(parser.errors).extend(comp.warnings).extend(comp.errors)
+            except compiler.lang.common.error.SphynxError as e:
+                diagnostics.add(e)
+            report()
+            print(f"Finished in {perf_counter() - start:.4f}s")
+            return
+
+        try:
+            lexer = _lexer.Lexer(str(file), source)
+            # Lexing as the parser goes reports every lexer and syntax error, lex() stops at the first lexer error
+            tokens = lexer.stream()
+            if args.verbose or args.dump_tokens:
+                tokens = lexer.lex()
+            if args.verbose:
+                print(f"Lexed in {perf_counter() - start:.4f}s")
+                print(tokens)
+            if args.dump_tokens:
+                with open(args.dump_tokens, "wb") as f:
+                    serialize.dump(tokens, f)
+            parser = _parser.Parser(str(file), tokens, factory)
+            ast = parser.parse()
+            if parser.errors:
+                # Every syntax error in the file is reported at once
+                diagnostics.extend(parser.errors)
+                report()
+        except compiler.lang.common.error.SphynxError as e:
+            diagnostics.add(e)
+            report()
+        if args.verbose:
+            print(f"Parsed in {perf_counter() - start:.4f}s")
+            if factory:
+                print(f"Shared {factory.shared} of {factory.created} expression nodes")
+            print(ast)
+        if args.dump_ast:
+            with open(args.dump_ast, "wb") as f:
+                # Shared nodes would otherwise all be written with the span of their first occurrence
+                serialize.dump(factory.expand(ast) if factory else ast, f)
+
+        if not args.disable_code_gen:
+            try:
+                comp = _compiler.Compiler(str(file), ast, args.optimize, args.jobs, args.split,
+                                          line_directives=args.line_directives, source_map=args.source_map,
+                                          instrument=args.instrument, factory=factory, output=str(output))
+                comp.compile()
+                diagnostics.extend(comp.warnings).extend(comp.errors)
+            except compiler.lang.common.error.SphynxError as e:
+                diagnostics.add(e)
+            report()
+            with open(output, "w") as f:
+                f.write(comp.out)
+            if comp.source_map:
+                with open(output.with_suffix(".map.json"), "w") as f:
+                    f.write(comp.source_map)
+            for n, unit in enumerate(comp.units, 1):
+                with open(_compiler.unit_path(output, n), "w") as f:
+                    f.write(unit)
+            if args.verbose:
+                print(f"Compiled in {perf_counter() - start:.4f}s")
+                print("\n".join(comp.optimizer.report))
+                print(comp.out)
+        else:
+            report()
+        print(f"Finished in {perf_counter() - start:.4f}s")
+    finally:
+        # Tokens and diagnostics hold decoded text, nothing refers into the mapping once done
+        if isinstance(source, mmap):
+            source.close()
+
+
+if __name__ == "__main__":
+    main()